@@ -1,55 +1,98 @@
 """
 defines the streamlit app for interacting with maps
 """
+import copy
+import io
+import os
 from typing import Dict
+
+import matplotlib
+
+# figures are only rendered to PNG bytes
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt
 import streamlit as st
 
 from rattle_snake.constants import BeingCulture
+from rattle_snake.instrument import Instrumentation
 from rattle_snake.plane_map import PlaneMap
-from rattle_snake.db_helpers import create_connection, get_num_circles
+from rattle_snake.db_helpers import get_num_circles, get_plane_node_counts
 
 db_file = "./beings-2022-12-07-22-41-32.db"
 
-st.title("Project Rattle Snake")
+# one entry per plane, older versions of a plane are evicted first
+MAX_CACHED_PLANES = len(BeingCulture)
 
-st.markdown(
-    "An app for generating places for [beings](https://github.com/joedaws/beings) to live"
-)
+
+def db_modified_time(db_file: str) -> float:
+    """Latest modification of the database, including its write ahead log
+
+    Used in the cache keys so that cached maps are dropped when the
+    database changes.
+    """
+    wal_file = db_file + "-wal"
+    modified_time = os.path.getmtime(db_file)
+    if os.path.exists(wal_file):
+        modified_time = max(modified_time, os.path.getmtime(wal_file))
+    return modified_time
 
 
-@st.cache
-def load_weird_map():
-    return PlaneMap(db_file=db_file, being_culture=BeingCulture.WEIRD)
+@st.cache_data(max_entries=MAX_CACHED_PLANES)
+def load_plane_summary(db_file: str, modified_time: float) -> Dict[str, int]:
+    return get_plane_node_counts(db_file)
 
 
-@st.cache
-def load_dream_map():
-    return PlaneMap(db_file=db_file, being_culture=BeingCulture.DREAM)
+@st.cache_data(max_entries=MAX_CACHED_PLANES)
+def load_num_circles(db_file: str, modified_time: float, plane: str) -> int:
+    return get_num_circles(db_file=db_file, plane=plane)
 
 
-@st.cache
-def load_deep_map():
-    return PlaneMap(db_file=db_file, being_culture=BeingCulture.DEEP)
+@st.cache_resource(max_entries=MAX_CACHED_PLANES)
+def load_map(db_file: str, modified_time: float, plane: str) -> PlaneMap:
+    """Load one plane, shared by every session until the database changes"""
+    return PlaneMap(db_file=db_file, being_culture=BeingCulture(plane))
 
 
-map_generating_state = st.text("Loading data...")
+@st.cache_data(max_entries=MAX_CACHED_PLANES)
+def render_map(db_file: str, modified_time: float, plane: str) -> bytes:
+    """Draw the plane once and keep the PNG
 
-conn = create_connection(db_file=db_file)
-cur = conn.cursor()
-cur.execute("""SELECT COUNT(*) from nodes""")
-rows = cur.fetchall()
+    Sessions can render at the same time, so the figure is drawn on a copy
+    of the shared map. The copy shares its read only tables.
+    """
+    plane_map = copy.copy(load_map(db_file, modified_time, plane))
+    plane_map.instrumentation = Instrumentation()
+    plane_map.draw()
+    image = io.BytesIO()
+    plane_map.fig.savefig(image, format="png")
+    plt.close(plane_map.fig)
+    return image.getvalue()
+
+
+st.title("Project Rattle Snake")
+
+st.markdown(
+    "An app for generating places for [beings](https://github.com/joedaws/beings) to live"
+)
+
+modified_time = db_modified_time(db_file)
+node_counts = load_plane_summary(db_file, modified_time)
 st.markdown(f"DB File: {db_file}")
-st.markdown(f"Query returned: {rows}")
 
-num_circles = get_num_circles(db_file=db_file, plane="deep_denizen")
-st.markdown(f"Num circles query Query returned: {num_circles}")
+cultures = [culture for culture in BeingCulture if culture.value in node_counts]
+if not cultures:
+    st.warning("The database has no planes")
+    st.stop()
 
-# maps = {
-#    BeingCulture.WEIRD: load_weird_map(),
-#    BeingCulture.DEEP: load_deep_map(),
-#    BeingCulture.DREAM: load_dream_map,
-# }
+being_culture = st.selectbox(
+    "Plane", cultures, format_func=lambda culture: culture.value
+)
+plane = being_culture.value
 
-map_generating_state.text("Using cached data")
+st.markdown(f"Nodes: {node_counts[plane]}")
+num_circles = load_num_circles(db_file, modified_time, plane)
+st.markdown(f"Num circles: {num_circles}")
 
-current_map = load_deep_map()
+with st.spinner("Loading map..."):
+    st.image(render_map(db_file, modified_time, plane))
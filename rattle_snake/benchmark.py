@@ -0,0 +1,293 @@
+"""
+Run this script to benchmark map generation, persistence, loading and drawing
+
+    poetry run python -m rattle_snake.benchmark --k 5 --k 9 --output results.jsonl
+
+Every phase of every case is timed separately and written as one JSON object
+per line so that the results of different runs can be compared. Cases whose
+population centers don't fit in their strata are recorded with the error.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict
+from itertools import product
+from typing import Callable, Dict, List, Optional, Tuple
+
+# draw without a display
+os.environ.setdefault("MPLBACKEND", "Agg")
+
+import click
+import matplotlib.pyplot as plt
+import numpy as np
+
+from rattle_snake.cluster import ClusterIndex
+from rattle_snake.constants import BeingCulture
+from rattle_snake.db_helpers import BulkWriteStats, bulk_write, db_setup, migrate
+from rattle_snake.db_pool import close_connections, writer
+from rattle_snake.placement import InfeasiblePlacementError
+from rattle_snake.plane_map import PlaneMap
+
+
+PHASES = ["generate", "link", "connect", "bulk_write", "save_to_db", "load_map", "draw"]
+
+# schema version with only the nodes and edges tables and their indexes,
+# bulk writes into it are the baseline for the full schema's derived tables
+BASELINE_SCHEMA_VERSION = 2
+
+
+@dataclass
+class BenchmarkCase:
+    num_circles: int
+    center_k: int
+    k: int
+    min_support: int
+    max_support: int
+
+
+def measure(fn: Callable, trace_memory: bool) -> Tuple[float, Optional[int], object]:
+    """Time fn or record the peak memory it allocates
+
+    Tracing slows fn down, the seconds of a traced call shouldn't be used.
+
+    Returns:
+        The seconds taken, the peak traced bytes (None when not traced) and
+        the return value of fn.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = fn()
+        seconds = time.perf_counter() - start
+        peak_bytes = tracemalloc.get_traced_memory()[1] if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+
+    return seconds, peak_bytes, result
+
+
+def new_db(work_dir: str, schema_version: Optional[int] = None) -> str:
+    """Create a database in work_dir at the schema version, the latest when None"""
+    db_file = os.path.join(work_dir, f"bulk-write-{schema_version}.db")
+    with writer(db_file) as conn:
+        migrate(conn, schema_version)
+    return db_file
+
+
+def remove_db(db_file: str) -> None:
+    close_connections(db_file)
+    os.remove(db_file)
+
+
+def write_rows(plane_map: PlaneMap, db_file: str) -> BulkWriteStats:
+    """bulk_write the nodes and edges of the plane into db_file"""
+    return bulk_write(
+        db_file, plane_map.nodes.to_db_rows(), plane_map.edges.to_db_rows()
+    )
+
+
+def run_case(
+    case: BenchmarkCase, seed: int, trace_memory: bool, work_dir: str
+) -> List[Dict]:
+    """Run every phase of the case once"""
+    measurements = {}
+
+    def record(phase: str, fn: Callable):
+        seconds, peak_bytes, result = measure(fn, trace_memory)
+        measurements[phase] = {"seconds": seconds, "peak_bytes": peak_bytes}
+        return result
+
+    plane_map = record(
+        "generate",
+        lambda: PlaneMap(being_culture=BeingCulture.WEIRD, seed=seed, **asdict(case)),
+    )
+    # the spans inside generation break its time down further
+    measurements["generate"].update(plane_map.instrumentation.to_dict())
+
+    # linking and connecting are timed again on their own from the nodes
+    nodes = plane_map.nodes
+    cluster_index = ClusterIndex(nodes)
+    _, sources, targets, _ = record("link", cluster_index.nearest_foreign)
+    connections = np.column_stack(
+        [nodes.cluster_id[sources], nodes.cluster_id[targets]]
+    )
+    record("connect", lambda: cluster_index.connect(connections))
+
+    # the same rows written without the R*Tree and the other derived tables,
+    # creating the databases isn't part of the write
+    baseline_db_file = new_db(work_dir, BASELINE_SCHEMA_VERSION)
+    baseline = write_rows(plane_map, baseline_db_file)
+    remove_db(baseline_db_file)
+    bulk_write_db_file = new_db(work_dir)
+    stats = record("bulk_write", lambda: write_rows(plane_map, bulk_write_db_file))
+    remove_db(bulk_write_db_file)
+    measurements["bulk_write"].update(
+        rows_per_second=stats.rows_per_second,
+        baseline_rows_per_second=baseline.rows_per_second,
+        baseline_ratio=stats.rows_per_second / baseline.rows_per_second,
+    )
+
+    db_file = os.path.join(work_dir, f"benchmark-{seed}.db")
+    db_setup(db_file)
+    record("save_to_db", lambda: plane_map.save_to_db(db_file=db_file))
+    loaded_map = record(
+        "load_map",
+        lambda: PlaneMap(db_file=db_file, being_culture=BeingCulture.WEIRD),
+    )
+    record("draw", loaded_map.draw)
+    plt.close(loaded_map.fig)
+    remove_db(db_file)
+
+    return [
+        {
+            **asdict(case),
+            "phase": phase,
+            "seed": seed,
+            "num_nodes": len(plane_map.nodes),
+            "num_edges": len(plane_map.edges),
+            **measurements[phase],
+        }
+        for phase in PHASES
+    ]
+
+
+def environment() -> Dict:
+    """Describe where the benchmark ran"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+    }
+
+
+def run_benchmarks(
+    cases: List[BenchmarkCase], repeats: int, seed: int, trace_memory: bool
+) -> List[Dict]:
+    """Run every case repeats times, the seed of repeat i is seed + i
+
+    The phases are timed without tracing memory. When trace_memory is set,
+    each repeat is run a second time with the same seed to record the peak
+    memory of the phases.
+    """
+    env = environment()
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for case in cases:
+            for repeat in range(repeats):
+                try:
+                    case_results = run_case(case, seed + repeat, False, work_dir)
+                    if trace_memory:
+                        traced = run_case(case, seed + repeat, True, work_dir)
+                        for result, traced_result in zip(case_results, traced):
+                            result["peak_bytes"] = traced_result["peak_bytes"]
+                except InfeasiblePlacementError as e:
+                    case_results = [
+                        {
+                            **asdict(case),
+                            "phase": "generate",
+                            "seed": seed + repeat,
+                            "error": str(e),
+                        }
+                    ]
+                for result in case_results:
+                    results.append({**result, "repeat": repeat, **env})
+
+    return results
+
+
+@click.command()
+@click.option("--num-circles", multiple=True, type=int, default=[3, 4])
+@click.option("--center-k", multiple=True, type=int, default=[3])
+@click.option("--k", "ks", multiple=True, type=int, default=[5, 7])
+@click.option(
+    "--support",
+    multiple=True,
+    type=(int, int),
+    default=[(3, 10), (500, 1000)],
+    help="min and max number of supporting nodes",
+)
+@click.option("--repeats", default=3, help="Runs of each case")
+@click.option("--seed", default=0, help="Seed of the first repeat")
+@click.option(
+    "--memory/--no-memory",
+    default=True,
+    help="Record peak memory in a second run of each case",
+)
+@click.option("--output", type=click.Path(), help="JSON lines file for the results")
+@click.option(
+    "--min-write-ratio",
+    type=float,
+    help="Fail when a bulk write is slower than this fraction of the baseline",
+)
+def main(
+    num_circles, center_k, ks, support, repeats, seed, memory, output, min_write_ratio
+):
+    """Sweep the generation parameters and time every phase"""
+    cases = [
+        BenchmarkCase(
+            num_circles=circles,
+            center_k=c_k,
+            k=k,
+            min_support=min_support,
+            max_support=max_support,
+        )
+        for circles, c_k, k, (min_support, max_support) in product(
+            num_circles, center_k, ks, support
+        )
+    ]
+    results = run_benchmarks(cases, repeats=repeats, seed=seed, trace_memory=memory)
+
+    lines = [json.dumps(result) for result in results]
+    if output:
+        with open(output, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        click.echo(f"wrote {len(results)} results to {output}")
+    else:
+        click.echo("\n".join(lines))
+
+    for result in results:
+        if "error" in result:
+            click.echo(
+                f"skipped num_circles={result['num_circles']} k={result['k']} "
+                f"seed={result['seed']}: {result['error']}",
+                err=True,
+            )
+
+    if min_write_ratio is not None:
+        slow = [
+            result
+            for result in results
+            if result["phase"] == "bulk_write"
+            and result["baseline_ratio"] < min_write_ratio
+        ]
+        for result in slow:
+            click.echo(
+                f"bulk_write of {result['num_nodes']} nodes ran at "
+                f"{result['rows_per_second']:.0f} rows/sec, "
+                f"{result['baseline_ratio']:.2f} of the baseline",
+                err=True,
+            )
+        if slow:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,67 +1,329 @@
-from dataclasses import dataclass
-from typing import List, Tuple
+from typing import Iterable, Optional, Tuple
 
 import numpy as np
-from sklearn.neighbors import NearestNeighbors
 
 
-from rattle_snake.node import Node
+from rattle_snake.tables import NodeTable
 
 
-@dataclass
-class Cluster:
-    population_center: Node
-    supporting_nodes: List[Node]
+class DisjointSet:
+    """Union-find over the integers 0, 1, ..., size - 1"""
 
-    def cluster_id(self) -> int:
-        return self.population_center.node_id
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+        self.rank = [0] * size
+        self.num_components = size
 
+    def add(self) -> int:
+        """Add a new item in a set of its own and return it"""
+        self.parent.append(len(self.parent))
+        self.rank.append(0)
+        self.num_components += 1
+        return len(self.parent) - 1
 
-def find_closest_nodes(
-    clusters: List[Cluster], cluster: Cluster
-) -> Tuple[Node, Node, float]:
-    """Find the nearest node among all other cluster's nodes to one of the cluter nodes"""
+    def find(self, item: int) -> int:
+        """Find the representative of the set containing item"""
+        parent = self.parent
+        while parent[item] != item:
+            # path halving
+            parent[item] = parent[parent[item]]
+            item = parent[item]
 
-    cluster_nodes = [node for node in cluster.supporting_nodes]
-    cluster_nodes.append(cluster.population_center)
-    number_of_nodes_in_cluster = len(cluster_nodes)
-    neigh = NearestNeighbors(n_neighbors=number_of_nodes_in_cluster)
-    # the population center also needs to be included
-    points = [(node.x, node.y) for node in cluster_nodes]
-    neigh.fit(points)
+        return item
 
-    other_cluster_supporting_nodes = []
-    for other_cluster in [c for c in clusters if c.cluster_id != cluster.cluster_id]:
-        for node in other_cluster.supporting_nodes:
-            other_cluster_supporting_nodes.append(node)
+    def union(self, item1: int, item2: int) -> bool:
+        """Merge the sets of the two items, returns False if they were already merged"""
+        root1 = self.find(item1)
+        root2 = self.find(item2)
+        if root1 == root2:
+            return False
 
-    node2 = other_cluster_supporting_nodes[0]
-    distances, indexes = neigh.kneighbors([(node2.x, node2.y)])
-    node1 = cluster_nodes[indexes[0][0]]
-    min_distance = distances[0][0]
-    for n2 in other_cluster_supporting_nodes[1:]:
-        distances, indexes = neigh.kneighbors([(n2.x, n2.y)])
-        distance = distances[0][0]
-        if distance < min_distance:
-            node1 = cluster_nodes[indexes[0][0]]
-            node2 = n2
-            min_distance = distance
+        if self.rank[root1] < self.rank[root2]:
+            root1, root2 = root2, root1
+        self.parent[root2] = root1
+        if self.rank[root1] == self.rank[root2]:
+            self.rank[root1] += 1
+        self.num_components -= 1
 
-    return node1, node2, min_distance
+        return True
 
+    def labels(self) -> np.ndarray:
+        """Representative of every item"""
+        return np.array([self.find(item) for item in range(len(self.parent))])
 
-def find_closest_nodes_between_clusters(
-    cluster_group_1: List[Cluster], cluster_group_2: List[Cluster]
-) -> Tuple[Node, Node, float]:
-    """Find the nodes which are closest between the two groups"""
 
-    node1, node2, min_dist = find_closest_nodes(cluster_group_2, cluster_group_1[0])
-    for cluster in cluster_group_1[1:]:
+class ClusterIndex:
+    """Spatial index over the nodes of many clusters.
 
-        n1, n2, dist = find_closest_nodes(cluster_group_2, cluster)
-        if dist < min_dist:
-            node1 = n1
-            node2 = n2
-            min_dist = dist
+    A single KD-tree is built over the supporting nodes of every cluster and
+    each node is labelled by its cluster, whose label is the position of
+    the cluster's population center among the population centers of the
+    table. Linking queries are answered for all clusters at once with
+    batched KD-tree lookups. Every cluster_id of the table must have a
+    population center.
+    """
 
-    return node1, node2, min_dist
+    # number of neighbours asked for on the first pass of a query, this
+    # is doubled for the nodes whose neighbours all belong to their own group
+    # while that settles most of them, the rest is searched by group bits
+    initial_k = 8
+
+    def __init__(self, nodes: NodeTable):
+        from scipy.spatial import cKDTree
+
+        self.nodes = nodes
+        self.cluster_ids = nodes.cluster_id[nodes.is_population_center]
+        self._cluster_order = np.argsort(self.cluster_ids, kind="stable")
+        self.labels = self.cluster_labels(nodes.cluster_id)
+        self.xy = np.column_stack([nodes.x, nodes.y])
+        # only supporting nodes can be the far end of a link
+        self.support_index = np.flatnonzero(~nodes.is_population_center)
+        self.tree = cKDTree(self.xy[self.support_index])
+        # number of batched KD-tree queries and of points queried in them
+        self.num_queries = 0
+        self.num_query_points = 0
+
+    def cluster_labels(self, cluster_ids) -> np.ndarray:
+        """Labels of the clusters with the given ids"""
+        cluster_ids = np.asarray(cluster_ids, dtype=np.int64)
+        positions = np.searchsorted(
+            self.cluster_ids, cluster_ids, sorter=self._cluster_order
+        )
+        positions = np.minimum(positions, max(len(self.cluster_ids) - 1, 0))
+        labels = self._cluster_order[positions]
+        missing = self.cluster_ids[labels] != cluster_ids
+        if np.any(missing):
+            raise KeyError(
+                f"clusters without a population center: {cluster_ids[missing][:10]}"
+            )
+
+        return labels
+
+    def nearest_foreign(
+        self,
+        groups: Optional[np.ndarray] = None,
+        source_clusters: Optional[np.ndarray] = None,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Find the closest pair of nodes leaving each group of clusters
+
+        For every group the pair is made of a node of the group (population
+        centers included) and a supporting node of any other group.
+
+        Args:
+            groups (np.ndarray): group label of each cluster, defaults to every
+                cluster being its own group.
+            source_clusters (np.ndarray): labels of the clusters whose nodes
+                are queried, defaults to all of them. Groups without a
+                queried node are left out.
+
+        Returns:
+            The group labels, the indexes into ``self.nodes`` of the nodes
+            inside and outside of each group, and the distances between them.
+            Groups without any foreign supporting node are left out.
+        """
+        if groups is None:
+            groups = np.arange(len(self.cluster_ids))
+        node_groups = np.asarray(groups)[self.labels]
+        target_groups = node_groups[self.support_index]
+        num_targets = len(self.support_index)
+
+        # closest foreign distance found so far for each group
+        group_best = np.full(node_groups.max() + 1, np.inf)
+        best_dist = np.full(len(self.nodes), np.inf)
+        best_target = np.full(len(self.nodes), -1, dtype=np.intp)
+        # no foreign node is closer to a node than its neighbours in its group
+        lower_bound = np.zeros(len(self.nodes))
+        if source_clusters is None:
+            pending = np.arange(len(self.nodes))
+        else:
+            pending = np.flatnonzero(np.isin(self.labels, source_clusters))
+        k = min(self.initial_k, num_targets)
+        while pending.size and k > 0:
+            dist, idx = self.tree.query(self.xy[pending], k=k)
+            self.num_queries += 1
+            self.num_query_points += len(pending)
+            dist = dist.reshape(len(pending), k)
+            idx = idx.reshape(len(pending), k)
+
+            # neighbours come back sorted so the first foreign one is the closest
+            foreign = target_groups[idx] != node_groups[pending, None]
+            found = foreign.any(axis=1)
+            first = foreign.argmax(axis=1)
+            rows = np.flatnonzero(found)
+            best_dist[pending[rows]] = dist[rows, first[rows]]
+            best_target[pending[rows]] = idx[rows, first[rows]]
+            np.minimum.at(
+                group_best, node_groups[pending[rows]], dist[rows, first[rows]]
+            )
+
+            if k == num_targets:
+                # every target was looked at, the rest has no foreign node
+                pending = pending[:0]
+                break
+            # a node whose k neighbours are all in its own group can only
+            # improve on its group's best pair if the kth neighbour is closer
+            rows = np.flatnonzero(~found)
+            rows = rows[dist[rows, -1] < group_best[node_groups[pending[rows]]]]
+            lower_bound[pending[rows]] = dist[rows, -1]
+            # the nodes inside large groups need far more neighbours
+            is_settling = len(rows) <= len(pending) // 2
+            pending = pending[rows]
+            if not is_settling:
+                break
+            k = min(2 * k, num_targets)
+
+        if pending.size:
+            # the pairs of the outermost nodes of the groups without one yet
+            # bound the searches from the nodes inside them
+            unbounded = pending[np.isinf(group_best[node_groups[pending]])]
+            for sources in (self._outermost(unbounded, node_groups), pending):
+                self._nearest_foreign_by_bits(
+                    sources,
+                    node_groups,
+                    target_groups,
+                    lower_bound,
+                    best_dist,
+                    best_target,
+                    group_best,
+                )
+
+        # reduce to the closest pair of each group
+        sources = np.flatnonzero(best_target >= 0)
+        order = np.lexsort((best_dist[sources], node_groups[sources]))
+        sources = sources[order]
+        sorted_groups = node_groups[sources]
+        is_first = np.ones(len(sources), dtype=bool)
+        is_first[1:] = sorted_groups[1:] != sorted_groups[:-1]
+        sources = sources[is_first]
+
+        return (
+            node_groups[sources],
+            sources,
+            self.support_index[best_target[sources]],
+            best_dist[sources],
+        )
+
+    def _outermost(self, nodes: np.ndarray, node_groups: np.ndarray) -> np.ndarray:
+        """The nodes with the smallest and largest x and y of each group"""
+        groups = node_groups[nodes]
+        x, y = self.xy[nodes].T
+        outermost = []
+        for key in (x, -x, y, -y):
+            order = np.lexsort((key, groups))
+            is_first = np.ones(len(order), dtype=bool)
+            is_first[1:] = groups[order[1:]] != groups[order[:-1]]
+            outermost.append(nodes[order[is_first]])
+
+        return np.unique(np.concatenate(outermost))
+
+    def _nearest_foreign_by_bits(
+        self,
+        pending: np.ndarray,
+        node_groups: np.ndarray,
+        target_groups: np.ndarray,
+        lower_bound: np.ndarray,
+        best_dist: np.ndarray,
+        best_target: np.ndarray,
+        group_best: np.ndarray,
+    ) -> None:
+        """Closest foreign supporting node of the pending nodes, in place
+
+        Two different groups differ in at least one bit of their group
+        label, so the closest foreign node is the closest of the nodes that
+        differ from it in each bit. Per bit, the nodes are queried against
+        a tree of the targets on the other side, which never holds their own
+        group however large it is. A node is only queried while its lower
+        bound is below its group's best pair, and only for nodes closer than
+        that, which leaves out or cuts short the searches from the inside of
+        a large group.
+        """
+        from scipy.spatial import cKDTree
+
+        pending_bits = node_groups[pending]
+        for bit in range(int(node_groups.max()).bit_length()):
+            target_side = (target_groups >> bit) & 1
+            pending_side = (pending_bits >> bit) & 1
+            for side in (0, 1):
+                targets = np.flatnonzero(target_side != side)
+                sources = pending[pending_side == side]
+                sources = sources[
+                    lower_bound[sources] < group_best[node_groups[sources]]
+                ]
+                if not len(targets) or not len(sources):
+                    continue
+
+                tree = cKDTree(self.xy[self.support_index[targets]])
+                # the upper bound of a query is a scalar, so the nodes are
+                # queried in batches whose group bests round up to the same
+                # power of two
+                with np.errstate(divide="ignore"):
+                    exponents = np.ceil(np.log2(group_best[node_groups[sources]]))
+                for exponent in np.unique(exponents):
+                    batch = sources[exponents == exponent]
+                    dist, idx = tree.query(
+                        self.xy[batch], k=1, distance_upper_bound=2.0**exponent
+                    )
+                    self.num_queries += 1
+                    self.num_query_points += len(batch)
+                    closer = dist < best_dist[batch]
+                    best_dist[batch[closer]] = dist[closer]
+                    best_target[batch[closer]] = targets[idx[closer]]
+                    np.minimum.at(group_best, node_groups[batch[closer]], dist[closer])
+
+    def connect(
+        self,
+        cluster_connections: Iterable[Tuple[int, int]],
+        skip_largest: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Find the links that make the clusters a connected graph
+
+        The clusters are merged into components with the existing
+        connections. Following Boruvka, every round links each component to
+        its closest foreign node and the candidate links are accepted from
+        shortest to longest while they join different components. The number
+        of components at least halves every round.
+
+        Args:
+            cluster_connections: pairs of cluster ids which are already linked
+            skip_largest (bool): Don't query the nodes of the largest
+                component, which is still reached by the links of the others.
+                Used when a few clusters are added to a connected plane.
+
+        Returns:
+            The indexes into ``self.nodes`` of the two ends of each bridging
+            link which was added, and the lengths of the links
+        """
+        components = DisjointSet(len(self.cluster_ids))
+        connections = np.asarray(list(cluster_connections), dtype=np.int64)
+        for label1, label2 in self.cluster_labels(connections.reshape(-1, 2)).tolist():
+            components.union(label1, label2)
+
+        bridge_sources = []
+        bridge_targets = []
+        bridge_distances = []
+        while components.num_components > 1:
+            groups = components.labels()
+            source_clusters = None
+            if skip_largest:
+                largest = np.bincount(groups).argmax()
+                source_clusters = np.flatnonzero(groups != largest)
+            _, sources, targets, distances = self.nearest_foreign(
+                groups, source_clusters
+            )
+            num_components = components.num_components
+            for i in np.argsort(distances, kind="stable"):
+                source = sources[i]
+                target = targets[i]
+                if components.union(self.labels[source], self.labels[target]):
+                    bridge_sources.append(source)
+                    bridge_targets.append(target)
+                    bridge_distances.append(distances[i])
+
+            if components.num_components == num_components:
+                raise ValueError("The clusters can not be connected")
+
+        return (
+            np.array(bridge_sources, dtype=np.intp),
+            np.array(bridge_targets, dtype=np.intp),
+            np.array(bridge_distances, dtype=float),
+        )
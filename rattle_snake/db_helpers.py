@@ -1,8 +1,19 @@
+import logging
 import sqlite3
+import time
+from dataclasses import dataclass
 from datetime import datetime
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
-from rattle_snake.node import tuple_to_node
+import numpy as np
+
+from rattle_snake.db_pool import reader, writer
+from rattle_snake.node import Node, tuple_to_node
 from rattle_snake.edge import tuple_to_edge
+from rattle_snake.tables import NODE_DTYPE, EDGE_DTYPE
+
+logger = logging.getLogger(__name__)
 
 
 CREATE_NODES_TABLE_QUERY = """
@@ -30,12 +41,211 @@ CREATE TABLE IF NOT EXISTS edges (
 );
 """
 
+# every read filters on the plane, edges are traversed from their ends
+CREATE_INDEXES_QUERIES = [
+    "CREATE INDEX IF NOT EXISTS nodes_plane_stratum ON nodes (plane, stratum_id);",
+    "CREATE INDEX IF NOT EXISTS nodes_plane_cluster ON nodes (plane, cluster_id);",
+    "CREATE INDEX IF NOT EXISTS edges_plane_start ON edges (plane, start);",
+    'CREATE INDEX IF NOT EXISTS edges_plane_end ON edges (plane, "end");',
+]
+
+# Databases written before save_to_db stored node.cluster_id have the
+# node_id of every node in its cluster_id, which is only right for the
+# population centers. The edges from a population
+# center to its supporting nodes were written before any other edge, so a
+# supporting node's first edge from a population center is its own.
+FIX_CLUSTER_IDS_QUERIES = [
+    """
+    UPDATE nodes SET cluster_id = (
+      SELECT e.start from edges AS e JOIN nodes AS c ON c.node_id = e.start
+      WHERE e.plane = nodes.plane AND e."end" = nodes.node_id
+        AND c.is_population_center = 1
+      ORDER BY e.edge_id LIMIT 1
+    )
+    WHERE is_population_center = 0 AND EXISTS (
+      SELECT 1 from edges AS e JOIN nodes AS c ON c.node_id = e.start
+      WHERE e.plane = nodes.plane AND e."end" = nodes.node_id
+        AND c.is_population_center = 1
+    );
+    """,
+]
+
+NODES_RTREE_INSERT_TRIGGER_QUERY = """
+    CREATE TRIGGER IF NOT EXISTS nodes_rtree_insert AFTER INSERT ON nodes
+    BEGIN
+      INSERT INTO nodes_rtree (node_id, min_x, max_x, min_y, max_y, plane)
+      VALUES (new.node_id, new.x, new.x, new.y, new.y, new.plane);
+    END;
+    """
+
+# R*Tree over the node coordinates, kept in sync with the nodes table by
+# triggers so every insert also indexes the node. Bulk writes fill it
+# themselves, see bulk_write. Points are stored as boxes of zero size.
+CREATE_NODES_RTREE_QUERIES = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS nodes_rtree
+    USING rtree(node_id, min_x, max_x, min_y, max_y, +plane);
+    """,
+    """
+    INSERT INTO nodes_rtree (node_id, min_x, max_x, min_y, max_y, plane)
+    SELECT node_id, x, x, y, y, plane from nodes;
+    """,
+    NODES_RTREE_INSERT_TRIGGER_QUERY,
+    """
+    CREATE TRIGGER IF NOT EXISTS nodes_rtree_update
+    AFTER UPDATE OF node_id, x, y, plane ON nodes
+    BEGIN
+      DELETE FROM nodes_rtree WHERE node_id = old.node_id;
+      INSERT INTO nodes_rtree (node_id, min_x, max_x, min_y, max_y, plane)
+      VALUES (new.node_id, new.x, new.x, new.y, new.y, new.plane);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS nodes_rtree_delete AFTER DELETE ON nodes
+    BEGIN
+      DELETE FROM nodes_rtree WHERE node_id = old.node_id;
+    END;
+    """,
+]
+
+# shortest routes between the population centers of a plane, next_hop is
+# the node after source on the route and -1 when target can't be reached
+CREATE_POPULATION_CENTER_ROUTES_TABLE_QUERY = """
+CREATE TABLE IF NOT EXISTS population_center_routes (
+  plane TEXT NOT NULL,
+  source INTEGER NOT NULL,
+  target INTEGER NOT NULL,
+  distance REAL NOT NULL,
+  next_hop INTEGER NOT NULL,
+  PRIMARY KEY (plane, source, target)
+);
+"""
+
+NODES_RESOURCES_INSERT_TRIGGER_QUERY = """
+    CREATE TRIGGER IF NOT EXISTS nodes_resources_insert AFTER INSERT ON nodes
+    BEGIN
+      INSERT INTO cluster_resources (plane, cluster_id)
+      VALUES (new.plane, new.cluster_id)
+      ON CONFLICT (plane, cluster_id) DO UPDATE SET stale = 1;
+      INSERT INTO stratum_resources (plane, stratum_id)
+      VALUES (new.plane, new.stratum_id)
+      ON CONFLICT (plane, stratum_id) DO UPDATE SET stale = 1;
+    END;
+    """
+
+# totals of the resources of every cluster and stratum of a plane. The
+# triggers only mark the rows of the nodes' clusters and strata as stale,
+# bulk writes mark each of their clusters and strata once instead, and the
+# stale rows are recomputed by refresh_resource_aggregates. A row whose
+# nodes are all gone is removed.
+CREATE_RESOURCE_AGGREGATES_QUERIES = [
+    """
+    CREATE TABLE IF NOT EXISTS cluster_resources (
+      plane TEXT NOT NULL,
+      cluster_id INTEGER NOT NULL,
+      stratum_id INTEGER NOT NULL DEFAULT 0,
+      num_nodes INTEGER NOT NULL DEFAULT 0,
+      total_resource_yeild INTEGER NOT NULL DEFAULT 0,
+      centroid_x REAL NOT NULL DEFAULT 0,
+      centroid_y REAL NOT NULL DEFAULT 0,
+      bounding_radius REAL NOT NULL DEFAULT 0,
+      stale INTEGER NOT NULL DEFAULT 1,
+      PRIMARY KEY (plane, cluster_id)
+    );
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS stratum_resources (
+      plane TEXT NOT NULL,
+      stratum_id INTEGER NOT NULL,
+      num_nodes INTEGER NOT NULL DEFAULT 0,
+      num_clusters INTEGER NOT NULL DEFAULT 0,
+      total_resource_yeild INTEGER NOT NULL DEFAULT 0,
+      centroid_x REAL NOT NULL DEFAULT 0,
+      centroid_y REAL NOT NULL DEFAULT 0,
+      bounding_radius REAL NOT NULL DEFAULT 0,
+      stale INTEGER NOT NULL DEFAULT 1,
+      PRIMARY KEY (plane, stratum_id)
+    );
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS cluster_resources_stale
+    ON cluster_resources (plane) WHERE stale = 1;
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS stratum_resources_stale
+    ON stratum_resources (plane) WHERE stale = 1;
+    """,
+    """
+    INSERT OR IGNORE INTO cluster_resources (plane, cluster_id)
+    SELECT DISTINCT plane, cluster_id from nodes;
+    """,
+    """
+    INSERT OR IGNORE INTO stratum_resources (plane, stratum_id)
+    SELECT DISTINCT plane, stratum_id from nodes;
+    """,
+    NODES_RESOURCES_INSERT_TRIGGER_QUERY,
+    """
+    CREATE TRIGGER IF NOT EXISTS nodes_resources_update
+    AFTER UPDATE OF x, y, plane, stratum_id, cluster_id, is_population_center,
+      resource_yeild ON nodes
+    BEGIN
+      UPDATE cluster_resources SET stale = 1
+      WHERE plane = old.plane AND cluster_id = old.cluster_id;
+      UPDATE stratum_resources SET stale = 1
+      WHERE plane = old.plane AND stratum_id = old.stratum_id;
+      INSERT INTO cluster_resources (plane, cluster_id)
+      VALUES (new.plane, new.cluster_id)
+      ON CONFLICT (plane, cluster_id) DO UPDATE SET stale = 1;
+      INSERT INTO stratum_resources (plane, stratum_id)
+      VALUES (new.plane, new.stratum_id)
+      ON CONFLICT (plane, stratum_id) DO UPDATE SET stale = 1;
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS nodes_resources_delete AFTER DELETE ON nodes
+    BEGIN
+      UPDATE cluster_resources SET stale = 1
+      WHERE plane = old.plane AND cluster_id = old.cluster_id;
+      UPDATE stratum_resources SET stale = 1
+      WHERE plane = old.plane AND stratum_id = old.stratum_id;
+    END;
+    """,
+]
+
+# The schema version of a database is stored in its user_version pragma.
+# Migration i brings a database from version i to version i + 1, so new
+# changes to the schema are appended here and never edited afterwards.
+SCHEMA_MIGRATIONS = [
+    [CREATE_NODES_TABLE_QUERY, CREATE_EDGES_TABLE_QUERY],
+    CREATE_INDEXES_QUERIES,
+    FIX_CLUSTER_IDS_QUERIES,
+    CREATE_NODES_RTREE_QUERIES,
+    [CREATE_POPULATION_CENTER_ROUTES_TABLE_QUERY],
+    CREATE_RESOURCE_AGGREGATES_QUERIES,
+]
+
 
 INSERT_NODE_QUERY = """
 INSERT INTO nodes (node_id,x,y,plane,stratum_id,cluster_id,is_population_center,resource_yeild)
 VALUES(?,?,?,?,?,?,?,?)
 """
 
+INSERT_NODE_RTREE_QUERY = """
+INSERT INTO nodes_rtree (node_id,min_x,max_x,min_y,max_y,plane)
+VALUES(?,?,?,?,?,?)
+"""
+
+
+MARK_CLUSTER_RESOURCES_STALE_QUERY = """
+INSERT INTO cluster_resources (plane, cluster_id) VALUES(?,?)
+ON CONFLICT (plane, cluster_id) DO UPDATE SET stale = 1;
+"""
+
+MARK_STRATUM_RESOURCES_STALE_QUERY = """
+INSERT INTO stratum_resources (plane, stratum_id) VALUES(?,?)
+ON CONFLICT (plane, stratum_id) DO UPDATE SET stale = 1;
+"""
+
 
 INSERT_EDGE_QUERY = """
 INSERT INTO edges (edge_id,start,end,plane,length)
@@ -56,18 +266,195 @@ GET_PLANE_EDGES_QUERY = """
 SELECT * from edges where plane = ?;
 """
 
+COUNT_PLANE_ROWS_QUERY = """
+SELECT COUNT(*) from {table} where plane = ?;
+"""
+
+# node_id and edge_id are the rowids of their tables
+LOAD_PLANE_COLUMNS_QUERY = """
+SELECT {columns} from {table} where plane = ? ORDER BY rowid;
+"""
+
+# table column names of the NodeTable and EdgeTable columns
+NODE_DB_COLUMNS = {name: name for name in NODE_DTYPE.names}
+EDGE_DB_COLUMNS = {
+    "edge_id": "edge_id",
+    "start_node_id": "start",
+    "end_node_id": "end",
+    "length": "length",
+}
+
+# The R*Tree stores 32 bit floats rounded outwards, so candidates are
+# checked again against the exact coordinates of the nodes table.
+NODES_IN_BOX_QUERY = """
+SELECT n.* from nodes_rtree AS r JOIN nodes AS n ON n.node_id = r.node_id
+WHERE r.max_x >= :min_x AND r.min_x <= :max_x
+  AND r.max_y >= :min_y AND r.min_y <= :max_y
+  AND r.plane = :plane
+  AND n.x BETWEEN :min_x AND :max_x
+  AND n.y BETWEEN :min_y AND :max_y
+  {filter}
+"""
+
+NODES_IN_RADIUS_QUERY = NODES_IN_BOX_QUERY + """
+  AND (n.x - :x) * (n.x - :x) + (n.y - :y) * (n.y - :y) <= :radius * :radius
+ORDER BY (n.x - :x) * (n.x - :x) + (n.y - :y) * (n.y - :y)
+LIMIT :limit;
+"""
+
+POPULATION_CENTER_FILTER = "AND n.is_population_center = 1"
+
+COUNT_PLANE_NODES_QUERY = """
+SELECT COUNT(*) from nodes AS n where n.plane = ? {filter};
+"""
+
+DELETE_POPULATION_CENTER_ROUTES_QUERY = """
+DELETE from population_center_routes where plane = ?;
+"""
+
+INSERT_POPULATION_CENTER_ROUTE_QUERY = """
+INSERT INTO population_center_routes (plane,source,target,distance,next_hop)
+VALUES(?,?,?,?,?)
+"""
+
+GET_POPULATION_CENTER_ROUTES_QUERY = """
+SELECT source, target, distance, next_hop from population_center_routes
+where plane = ?;
+"""
+
+MAX_IDS_QUERY = """
+SELECT (SELECT IFNULL(MAX(node_id), 0) from nodes),
+       (SELECT IFNULL(MAX(edge_id), 0) from edges);
+"""
+
+DELETE_PLANE_NODES_FROM_QUERY = """
+DELETE from nodes where plane = ? AND node_id >= ?;
+"""
+
+DELETE_PLANE_EDGES_FROM_QUERY = """
+DELETE from edges where plane = ? AND edge_id >= ?;
+"""
+
+PLANE_NODE_COUNTS_QUERY = """
+SELECT plane, COUNT(*) from nodes GROUP BY plane;
+"""
+
+STALE_RESOURCE_PLANES_QUERY = """
+SELECT plane from cluster_resources WHERE stale = 1
+UNION
+SELECT plane from stratum_resources WHERE stale = 1;
+"""
+
+HAS_STALE_RESOURCES_QUERY = """
+SELECT EXISTS (SELECT 1 from cluster_resources WHERE plane = ? AND stale = 1)
+    OR EXISTS (SELECT 1 from stratum_resources WHERE plane = ? AND stale = 1);
+"""
+
+STALE_RESOURCE_NODES_QUERY = """
+SELECT r.{key}, n.stratum_id, n.x, n.y, n.resource_yeild, n.is_population_center
+from {table} AS r JOIN nodes AS n ON n.plane = r.plane AND n.{key} = r.{key}
+WHERE r.plane = ? AND r.stale = 1;
+"""
+
+DELETE_STALE_RESOURCES_QUERY = """
+DELETE from {table} WHERE plane = ? AND stale = 1;
+"""
+
+INSERT_CLUSTER_RESOURCES_QUERY = """
+INSERT INTO cluster_resources (plane, cluster_id, stratum_id, num_nodes,
+  total_resource_yeild, centroid_x, centroid_y, bounding_radius, stale)
+VALUES (?,?,?,?,?,?,?,?,0)
+"""
+
+INSERT_STRATUM_RESOURCES_QUERY = """
+INSERT INTO stratum_resources (plane, stratum_id, num_nodes, num_clusters,
+  total_resource_yeild, centroid_x, centroid_y, bounding_radius, stale)
+VALUES (?,?,?,?,?,?,?,?,0)
+"""
+
+GET_CLUSTER_RESOURCES_QUERY = """
+SELECT cluster_id, stratum_id, num_nodes, total_resource_yeild, centroid_x,
+  centroid_y, bounding_radius
+from cluster_resources WHERE plane = ? ORDER BY cluster_id;
+"""
+
+GET_STRATUM_RESOURCES_QUERY = """
+SELECT stratum_id, num_nodes, num_clusters, total_resource_yeild, centroid_x,
+  centroid_y, bounding_radius
+from stratum_resources WHERE plane = ? ORDER BY stratum_id;
+"""
+
+CLUSTER_RESOURCES_DTYPE = np.dtype(
+    [
+        ("cluster_id", np.int64),
+        ("stratum_id", np.int32),
+        ("num_nodes", np.int64),
+        ("total_resource_yeild", np.int64),
+        ("centroid_x", np.float64),
+        ("centroid_y", np.float64),
+        ("bounding_radius", np.float64),
+    ]
+)
+
+STRATUM_RESOURCES_DTYPE = np.dtype(
+    [
+        ("stratum_id", np.int32),
+        ("num_nodes", np.int64),
+        ("num_clusters", np.int64),
+        ("total_resource_yeild", np.int64),
+        ("centroid_x", np.float64),
+        ("centroid_y", np.float64),
+        ("bounding_radius", np.float64),
+    ]
+)
+
 GET_NODE_X_Y_QUERY = """
 SELECT x, y from nodes where node_id = ?;
 """
 
 
+# number of rows sent to sqlite in each executemany call of a bulk write
+BULK_BATCH_SIZE = 10000
+
+# values sqlite accepts for the pragmas set by configure_bulk_write
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF")
+SYNCHRONOUS_LEVELS = ("OFF", "NORMAL", "FULL", "EXTRA", "0", "1", "2", "3")
+
+
+# node insert triggers which bulk writes drop and do the work of once per
+# batch instead of once per row, with the schema version that added them
+BULK_WRITE_NODE_TRIGGERS = {
+    "nodes_rtree_insert": (
+        SCHEMA_MIGRATIONS.index(CREATE_NODES_RTREE_QUERIES) + 1,
+        NODES_RTREE_INSERT_TRIGGER_QUERY,
+    ),
+    "nodes_resources_insert": (
+        SCHEMA_MIGRATIONS.index(CREATE_RESOURCE_AGGREGATES_QUERIES) + 1,
+        NODES_RESOURCES_INSERT_TRIGGER_QUERY,
+    ),
+}
+
+
+@dataclass
+class BulkWriteStats:
+    num_nodes: int
+    num_edges: int
+    seconds: float
+
+    @property
+    def rows_per_second(self) -> float:
+        if self.seconds == 0:
+            return float("inf")
+        return (self.num_nodes + self.num_edges) / self.seconds
+
+
 def create_connection(db_file):
     """returns a connection to the db_file"""
     conn = None
     try:
         conn = sqlite3.connect(db_file)
     except Exception as e:
-        print(e)
+        logger.error(e)
 
     return conn
 
@@ -101,7 +488,7 @@ def create_node(conn, node):
     cur = conn.cursor()
     cur.execute(INSERT_NODE_QUERY, node)
     conn.commit()
-    print(f"added node {node}")
+    logger.debug("added node %s", node)
 
 
 def create_edge(conn, edge):
@@ -119,7 +506,133 @@ def create_edge(conn, edge):
     cur = conn.cursor()
     cur.execute(INSERT_EDGE_QUERY, edge)
     conn.commit()
-    print(f"added edge {edge}")
+    logger.debug("added edge %s", edge)
+
+
+def configure_bulk_write(
+    conn, journal_mode: str = "WAL", synchronous: str = "NORMAL"
+) -> None:
+    """Set the pragmas used while bulk writing
+
+    WAL with synchronous NORMAL only syncs at checkpoints instead of on every
+    commit, which is safe against application crashes.
+    """
+    # pragma values can't be bound as parameters
+    if journal_mode.upper() not in JOURNAL_MODES:
+        raise ValueError(
+            f"journal_mode must be one of {JOURNAL_MODES}, got {journal_mode!r}"
+        )
+    if synchronous.upper() not in SYNCHRONOUS_LEVELS:
+        raise ValueError(
+            f"synchronous must be one of {SYNCHRONOUS_LEVELS}, got {synchronous!r}"
+        )
+    conn.execute(f"PRAGMA journal_mode={journal_mode}")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+
+
+def _batches(rows: Iterable[Tuple], batch_size: int) -> Iterator[List[Tuple]]:
+    """Split the rows into lists of at most batch_size rows"""
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def _bulk_create_nodes(conn, nodes: Iterable[Tuple], batch_size: int) -> int:
+    """Insert node tuples (see create_node) without per row insert triggers
+
+    The triggers are dropped and recreated inside the write's transaction,
+    so they're back whether it is committed or rolled back. Meanwhile the
+    R*Tree rows of each batch go in with their own executemany and the
+    resources of every written cluster and stratum are marked stale once.
+    Returns the number of inserted nodes.
+    """
+    if not conn.in_transaction:
+        conn.execute("BEGIN")
+    version = get_schema_version(conn)
+    triggers = {
+        name: query
+        for name, (added_in, query) in BULK_WRITE_NODE_TRIGGERS.items()
+        if version >= added_in
+    }
+    for name in triggers:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+    num_nodes = 0
+    clusters = set()
+    strata = set()
+    cur = conn.cursor()
+    for batch in _batches(nodes, batch_size):
+        cur.executemany(INSERT_NODE_QUERY, batch)
+        if "nodes_rtree_insert" in triggers:
+            cur.executemany(
+                INSERT_NODE_RTREE_QUERY,
+                ((node_id, x, x, y, y, plane) for node_id, x, y, plane, *_ in batch),
+            )
+        if "nodes_resources_insert" in triggers:
+            for _, _, _, plane, stratum_id, cluster_id, *_ in batch:
+                clusters.add((plane, cluster_id))
+                strata.add((plane, stratum_id))
+        num_nodes += len(batch)
+
+    if "nodes_resources_insert" in triggers:
+        cur.executemany(MARK_CLUSTER_RESOURCES_STALE_QUERY, clusters)
+        cur.executemany(MARK_STRATUM_RESOURCES_STALE_QUERY, strata)
+    for query in triggers.values():
+        conn.execute(query)
+
+    return num_nodes
+
+
+def create_edges(
+    conn, edges: Iterable[Tuple], batch_size: int = BULK_BATCH_SIZE
+) -> int:
+    """Insert edge tuples (see create_edge) without committing
+
+    Returns the number of inserted edges.
+    """
+    num_edges = 0
+    cur = conn.cursor()
+    for batch in _batches(edges, batch_size):
+        cur.executemany(INSERT_EDGE_QUERY, batch)
+        num_edges += len(batch)
+
+    return num_edges
+
+
+def bulk_write(
+    db_file: str,
+    nodes: Iterable[Tuple],
+    edges: Iterable[Tuple],
+    journal_mode: str = "WAL",
+    synchronous: str = "NORMAL",
+    batch_size: int = BULK_BATCH_SIZE,
+) -> BulkWriteStats:
+    """Write all the nodes and edges in one transaction
+
+    The rows are streamed from the iterables in batches of batch_size, so
+    they can be generators.
+    """
+    start = time.perf_counter()
+    # the writer commits or rolls back the whole transaction
+    with writer(db_file) as conn:
+        configure_bulk_write(conn, journal_mode=journal_mode, synchronous=synchronous)
+        num_nodes = _bulk_create_nodes(conn, nodes, batch_size=batch_size)
+        num_edges = create_edges(conn, edges, batch_size=batch_size)
+
+    stats = BulkWriteStats(
+        num_nodes=num_nodes,
+        num_edges=num_edges,
+        seconds=time.perf_counter() - start,
+    )
+    logger.info(
+        "wrote %d nodes and %d edges to %s (%.0f rows/sec)",
+        num_nodes,
+        num_edges,
+        db_file,
+        stats.rows_per_second,
+    )
+
+    return stats
 
 
 def generate_sqlite_db_file() -> str:
@@ -130,46 +643,496 @@ def generate_sqlite_db_file() -> str:
     return db_file_name
 
 
+def get_schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, target_version: Optional[int] = None) -> int:
+    """Apply the schema migrations the database is missing
+
+    Each migration runs in its own transaction together with the update of
+    the schema version. The database is brought up to target_version, the
+    latest version when None. Returns the new schema version.
+    """
+    if target_version is None:
+        target_version = len(SCHEMA_MIGRATIONS)
+    version = get_schema_version(conn)
+    for new_version in range(version + 1, target_version + 1):
+        conn.execute("BEGIN")
+        try:
+            for query in SCHEMA_MIGRATIONS[new_version - 1]:
+                conn.execute(query)
+            conn.execute(f"PRAGMA user_version = {new_version}")
+        except Exception:
+            conn.rollback()
+            raise
+        conn.commit()
+        logger.info("Migrated database schema to version %d", new_version)
+
+    return get_schema_version(conn)
+
+
 def db_setup(db_file: str):
-    """Sets up the database with tables if it hasn't already been setup."""
-    conn = create_connection(db_file=db_file)
-    create_nodes_table(conn)
-    create_edges_table(conn)
+    """Sets up the database with tables if it hasn't already been setup.
+
+    Databases created by earlier versions are upgraded in place.
+    """
+    with writer(db_file) as conn:
+        migrate(conn)
 
 
 def get_num_circles(db_file: str, plane: str) -> int:
-    conn = create_connection(db_file)
-    cur = conn.cursor()
-    cur.execute(NUM_CIRCLES_QUERY, (plane,))
-    rows = cur.fetchall()
-    print(f"While getting number of circles we got: {rows}")
+    with reader(db_file) as conn:
+        rows = conn.execute(NUM_CIRCLES_QUERY, (plane,)).fetchall()
+    logger.debug("While getting number of circles we got: %s", rows)
     num_circles = int(rows[0][0])
-    print(f"The number of cirlces retrived for {plane} was {num_circles}")
+    logger.debug("The number of cirlces retrived for %s was %d", plane, num_circles)
     return num_circles
 
 
 def get_plane_nodes(db_file: str, plane: str):
-    conn = create_connection(db_file)
-    cur = conn.cursor()
-    cur.execute(GET_PLANE_NODES_QUERY, (plane,))
-    rows = cur.fetchall()
-    print(f"Fetched {len(rows)} nodes from {db_file}")
+    with reader(db_file) as conn:
+        rows = conn.execute(GET_PLANE_NODES_QUERY, (plane,)).fetchall()
+    logger.debug("Fetched %d nodes from %s", len(rows), db_file)
     return list(map(lambda row: tuple_to_node(*row), rows))
 
 
 def get_plane_edges(db_file: str, plane: str):
-    conn = create_connection(db_file)
-    cur = conn.cursor()
-    cur.execute(GET_PLANE_EDGES_QUERY, (plane,))
-    rows = cur.fetchall()
-    print(f"Fetched {len(rows)} edges from {db_file}")
+    with reader(db_file) as conn:
+        rows = conn.execute(GET_PLANE_EDGES_QUERY, (plane,)).fetchall()
+    logger.debug("Fetched %d edges from %s", len(rows), db_file)
     return list(map(lambda row: tuple_to_edge(*row), rows))
 
 
 def get_node_x_y(db_file: str, node_id: int):
-    conn = create_connection(db_file)
-    cur = conn.cursor()
-    cur.execute(GET_NODE_X_Y_QUERY, (node_id,))
-    rows = cur.fetchall()
+    with reader(db_file) as conn:
+        rows = conn.execute(GET_NODE_X_Y_QUERY, (node_id,)).fetchall()
     # should only ever return info on ONE node
     return rows[0]
+
+
+def get_nodes_in_box(
+    db_file: str,
+    plane: str,
+    min_x: float,
+    max_x: float,
+    min_y: float,
+    max_y: float,
+    population_centers_only: bool = False,
+) -> List[Node]:
+    """Nodes of the plane inside the bounding box, found through the R*Tree"""
+    query = NODES_IN_BOX_QUERY.format(
+        filter=POPULATION_CENTER_FILTER if population_centers_only else ""
+    )
+    params = {
+        "plane": plane,
+        "min_x": min_x,
+        "max_x": max_x,
+        "min_y": min_y,
+        "max_y": max_y,
+    }
+    with reader(db_file) as conn:
+        rows = conn.execute(query, params).fetchall()
+    return [tuple_to_node(*row) for row in rows]
+
+
+def _query_radius(
+    conn, plane: str, x: float, y: float, radius: float, limit: int, node_filter: str
+) -> List[Tuple]:
+    params = {
+        "plane": plane,
+        "x": x,
+        "y": y,
+        "radius": radius,
+        "limit": limit,
+        "min_x": x - radius,
+        "max_x": x + radius,
+        "min_y": y - radius,
+        "max_y": y + radius,
+    }
+    query = NODES_IN_RADIUS_QUERY.format(filter=node_filter)
+    return conn.execute(query, params).fetchall()
+
+
+def get_nodes_within_radius(
+    db_file: str,
+    plane: str,
+    x: float,
+    y: float,
+    radius: float,
+    population_centers_only: bool = False,
+) -> List[Node]:
+    """Nodes of the plane within radius of (x, y), closest first"""
+    node_filter = POPULATION_CENTER_FILTER if population_centers_only else ""
+    with reader(db_file) as conn:
+        rows = _query_radius(conn, plane, x, y, radius, -1, node_filter)
+    return [tuple_to_node(*row) for row in rows]
+
+
+def get_nearest_nodes(
+    db_file: str,
+    plane: str,
+    x: float,
+    y: float,
+    k: int = 1,
+    population_centers_only: bool = False,
+    initial_radius: float = 0.5,
+) -> List[Node]:
+    """The k nodes of the plane closest to (x, y), closest first
+
+    The R*Tree has no nearest neighbour search, so radius queries are made
+    with a doubling radius until k nodes are found or the whole plane is
+    covered. Only the nodes in the final radius are read.
+
+    Args:
+        db_file (str): Path to a db_file
+        plane (str): Value of the plane's BeingCulture
+        x (float): x coordinate of the query point
+        y (float): y coordinate of the query point
+        k (int): Number of nodes to return
+        population_centers_only (bool): Only consider population centers
+        initial_radius (float): Radius of the first query
+    """
+    node_filter = POPULATION_CENTER_FILTER if population_centers_only else ""
+    radius = initial_radius
+    num_plane_nodes = None
+    with reader(db_file) as conn:
+        while True:
+            rows = _query_radius(conn, plane, x, y, radius, k, node_filter)
+            if len(rows) >= k:
+                break
+
+            # only count the plane when the first query comes up short
+            if num_plane_nodes is None:
+                count_query = COUNT_PLANE_NODES_QUERY.format(filter=node_filter)
+                num_plane_nodes = conn.execute(count_query, (plane,)).fetchone()[0]
+            if len(rows) >= num_plane_nodes:
+                break
+            radius *= 2
+
+    return [tuple_to_node(*row) for row in rows]
+
+
+def save_population_center_routes(
+    db_file: str,
+    plane: str,
+    node_ids: np.ndarray,
+    distances: np.ndarray,
+    next_hops: np.ndarray,
+    batch_size: int = BULK_BATCH_SIZE,
+) -> None:
+    """Replace the plane's population center routes
+
+    Args:
+        db_file (str): Path to a db_file
+        plane (str): Value of the plane's BeingCulture
+        node_ids: Ids of the population centers
+        distances: distances[i, j] is the route length from node_ids[i] to node_ids[j]
+        next_hops: next_hops[i, j] is the node after node_ids[i] on that route
+    """
+    sources, targets = np.meshgrid(node_ids, node_ids, indexing="ij")
+    rows = zip(
+        [plane] * sources.size,
+        sources.ravel().tolist(),
+        targets.ravel().tolist(),
+        distances.ravel().tolist(),
+        next_hops.ravel().tolist(),
+    )
+    with writer(db_file) as conn:
+        conn.execute(DELETE_POPULATION_CENTER_ROUTES_QUERY, (plane,))
+        for batch in _batches(rows, batch_size):
+            conn.executemany(INSERT_POPULATION_CENTER_ROUTE_QUERY, batch)
+
+
+def load_population_center_routes(
+    db_file: str, plane: str
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Load the plane's population center routes
+
+    Returns:
+        The population center ids in increasing order, the matrix of route
+        lengths and the matrix of next hop node ids, both indexed by the
+        position of the source and target in the ids.
+    """
+    with reader(db_file) as conn:
+        rows = conn.execute(GET_POPULATION_CENTER_ROUTES_QUERY, (plane,)).fetchall()
+
+    routes = np.array(
+        rows,
+        dtype=[
+            ("source", np.int64),
+            ("target", np.int64),
+            ("distance", np.float64),
+            ("next_hop", np.int64),
+        ],
+    )
+    node_ids = np.unique(routes["source"])
+    sources = np.searchsorted(node_ids, routes["source"])
+    targets = np.searchsorted(node_ids, routes["target"])
+
+    distances = np.full((len(node_ids), len(node_ids)), np.inf)
+    distances[sources, targets] = routes["distance"]
+    next_hops = np.full((len(node_ids), len(node_ids)), -1, dtype=np.int64)
+    next_hops[sources, targets] = routes["next_hop"]
+
+    return node_ids, distances, next_hops
+
+
+def get_plane_node_counts(db_file: str) -> Dict[str, int]:
+    """Number of nodes of each plane in the database"""
+    with reader(db_file) as conn:
+        rows = conn.execute(PLANE_NODE_COUNTS_QUERY).fetchall()
+    return dict(rows)
+
+
+def get_max_ids(db_file: str) -> Tuple[int, int]:
+    """Largest node_id and edge_id in the database, 0 when there are none"""
+    with reader(db_file) as conn:
+        rows = conn.execute(MAX_IDS_QUERY).fetchall()
+    return rows[0]
+
+
+def delete_plane_rows_from(
+    db_file: str, plane: str, first_node_id: int, first_edge_id: int
+) -> Tuple[int, int]:
+    """Delete the plane's nodes and edges from the given ids on
+
+    The resources of the clusters and strata of the deleted nodes are
+    marked stale by the delete trigger.
+
+    Returns:
+        The number of deleted nodes and edges
+    """
+    with writer(db_file) as conn:
+        num_nodes = conn.execute(
+            DELETE_PLANE_NODES_FROM_QUERY, (plane, first_node_id)
+        ).rowcount
+        num_edges = conn.execute(
+            DELETE_PLANE_EDGES_FROM_QUERY, (plane, first_edge_id)
+        ).rowcount
+    return num_nodes, num_edges
+
+
+def _load_plane_array(
+    db_file: str,
+    plane: str,
+    table: str,
+    dtype: np.dtype,
+    db_columns: Dict[str, str],
+    columns: Optional[Sequence[str]],
+    batch_size: int,
+) -> np.ndarray:
+    """Read the plane's rows of table into a preallocated structured array"""
+    columns = list(columns or dtype.names)
+    unknown = set(columns) - set(dtype.names)
+    if unknown:
+        raise ValueError(f"Unknown {table} columns: {sorted(unknown)}")
+    dtype = np.dtype([(name, dtype.fields[name][0]) for name in columns])
+
+    load_query = LOAD_PLANE_COLUMNS_QUERY.format(
+        columns=", ".join(f'"{db_columns[name]}"' for name in columns),
+        table=table,
+    )
+    with reader(db_file) as conn:
+        # the count and the rows are read in the same snapshot
+        conn.execute("BEGIN")
+        try:
+            count_query = COUNT_PLANE_ROWS_QUERY.format(table=table)
+            count = conn.execute(count_query, (plane,)).fetchone()[0]
+            data = np.empty(count, dtype=dtype)
+
+            cur = conn.execute(load_query, (plane,))
+            num_rows = 0
+            while rows := cur.fetchmany(batch_size):
+                data[num_rows : num_rows + len(rows)] = rows
+                num_rows += len(rows)
+        finally:
+            conn.rollback()
+
+    return data
+
+
+def load_plane_nodes(
+    db_file: str,
+    plane: str,
+    columns: Optional[Sequence[str]] = None,
+    batch_size: int = BULK_BATCH_SIZE,
+) -> np.ndarray:
+    """Load the plane's nodes into a structured array
+
+    Args:
+        db_file (str): Path to a db_file
+        plane (str): Value of the plane's BeingCulture
+        columns: Subset of the NODE_DTYPE columns to load, all when None
+        batch_size (int): Number of rows fetched from the cursor at a time
+
+    Returns:
+        An array of NODE_DTYPE, or of just the requested columns, ordered by node_id
+    """
+    return _load_plane_array(
+        db_file, plane, "nodes", NODE_DTYPE, NODE_DB_COLUMNS, columns, batch_size
+    )
+
+
+def load_plane_edges(
+    db_file: str,
+    plane: str,
+    columns: Optional[Sequence[str]] = None,
+    batch_size: int = BULK_BATCH_SIZE,
+) -> np.ndarray:
+    """Load the plane's edges into a structured array, see load_plane_nodes"""
+    return _load_plane_array(
+        db_file, plane, "edges", EDGE_DTYPE, EDGE_DB_COLUMNS, columns, batch_size
+    )
+
+
+def _resource_aggregates(nodes: np.ndarray) -> Iterator[Tuple]:
+    """Aggregate rows of key, stratum_id, x, y, resource_yeild and is_population_center
+
+    Yields:
+        key, stratum_id, num_nodes, num_population_centers,
+        total_resource_yeild, centroid_x, centroid_y and bounding_radius
+        for every key, the bounding radius is measured from the centroid
+    """
+    keys, first, inverse = np.unique(
+        nodes["key"], return_index=True, return_inverse=True
+    )
+    num_nodes = np.bincount(inverse)
+    num_population_centers = np.bincount(inverse, weights=nodes["is_population_center"])
+    totals = np.bincount(inverse, weights=nodes["resource_yeild"])
+    centroid_x = np.bincount(inverse, weights=nodes["x"]) / num_nodes
+    centroid_y = np.bincount(inverse, weights=nodes["y"]) / num_nodes
+    bounding_radius = np.zeros(len(keys))
+    np.maximum.at(
+        bounding_radius,
+        inverse,
+        np.hypot(nodes["x"] - centroid_x[inverse], nodes["y"] - centroid_y[inverse]),
+    )
+
+    yield from zip(
+        keys.tolist(),
+        nodes["stratum_id"][first].tolist(),
+        num_nodes.tolist(),
+        num_population_centers.astype(np.int64).tolist(),
+        totals.astype(np.int64).tolist(),
+        centroid_x.tolist(),
+        centroid_y.tolist(),
+        bounding_radius.tolist(),
+    )
+
+
+def refresh_resource_aggregates(
+    db_file: str, plane: Optional[str] = None
+) -> Tuple[int, int]:
+    """Recompute the stale cluster and stratum resource rows
+
+    Only the clusters and strata whose nodes changed since the last refresh
+    are read back and aggregated.
+
+    Args:
+        db_file (str): Path to a db_file
+        plane (str): Value of the plane's BeingCulture, every plane when None
+
+    Returns:
+        The number of cluster rows and stratum rows which were refreshed
+    """
+    node_dtype = [
+        ("key", np.int64),
+        ("stratum_id", np.int64),
+        ("x", np.float64),
+        ("y", np.float64),
+        ("resource_yeild", np.float64),
+        ("is_population_center", np.float64),
+    ]
+    num_clusters = 0
+    num_strata = 0
+    with writer(db_file) as conn:
+        if plane is None:
+            rows = conn.execute(STALE_RESOURCE_PLANES_QUERY).fetchall()
+            planes = [row[0] for row in rows]
+        else:
+            planes = [plane]
+
+        for stale_plane in planes:
+            clusters = np.array(
+                conn.execute(
+                    STALE_RESOURCE_NODES_QUERY.format(
+                        table="cluster_resources", key="cluster_id"
+                    ),
+                    (stale_plane,),
+                ).fetchall(),
+                dtype=node_dtype,
+            )
+            conn.execute(
+                DELETE_STALE_RESOURCES_QUERY.format(table="cluster_resources"),
+                (stale_plane,),
+            )
+            rows = [
+                (stale_plane, key, stratum_id, num_nodes, total, cx, cy, radius)
+                for key, stratum_id, num_nodes, _, total, cx, cy, radius in (
+                    _resource_aggregates(clusters)
+                )
+            ]
+            conn.executemany(INSERT_CLUSTER_RESOURCES_QUERY, rows)
+            num_clusters += len(rows)
+
+            strata = np.array(
+                conn.execute(
+                    STALE_RESOURCE_NODES_QUERY.format(
+                        table="stratum_resources", key="stratum_id"
+                    ),
+                    (stale_plane,),
+                ).fetchall(),
+                dtype=node_dtype,
+            )
+            conn.execute(
+                DELETE_STALE_RESOURCES_QUERY.format(table="stratum_resources"),
+                (stale_plane,),
+            )
+            # every cluster has exactly one population center
+            rows = [
+                (stale_plane, key, num_nodes, num_pop_centers, total, cx, cy, radius)
+                for key, _, num_nodes, num_pop_centers, total, cx, cy, radius in (
+                    _resource_aggregates(strata)
+                )
+            ]
+            conn.executemany(INSERT_STRATUM_RESOURCES_QUERY, rows)
+            num_strata += len(rows)
+
+    logger.debug(
+        "refreshed the resources of %d clusters and %d strata", num_clusters, num_strata
+    )
+    return num_clusters, num_strata
+
+
+def _get_resources(db_file: str, plane: str, query: str, dtype: np.dtype) -> np.ndarray:
+    with reader(db_file) as conn:
+        is_stale = conn.execute(HAS_STALE_RESOURCES_QUERY, (plane, plane)).fetchone()[0]
+    if is_stale:
+        refresh_resource_aggregates(db_file, plane)
+
+    with reader(db_file) as conn:
+        rows = conn.execute(query, (plane,)).fetchall()
+    return np.array(rows, dtype=dtype)
+
+
+def get_cluster_resources(db_file: str, plane: str) -> np.ndarray:
+    """Resource totals, node counts, centroid and bounding radius of every cluster
+
+    Returns:
+        An array of CLUSTER_RESOURCES_DTYPE ordered by cluster_id
+    """
+    return _get_resources(
+        db_file, plane, GET_CLUSTER_RESOURCES_QUERY, CLUSTER_RESOURCES_DTYPE
+    )
+
+
+def get_stratum_resources(db_file: str, plane: str) -> np.ndarray:
+    """Resource totals, node and cluster counts, centroid and radius of every stratum
+
+    Returns:
+        An array of STRATUM_RESOURCES_DTYPE ordered by stratum_id
+    """
+    return _get_resources(
+        db_file, plane, GET_STRATUM_RESOURCES_QUERY, STRATUM_RESOURCES_DTYPE
+    )
@@ -0,0 +1,107 @@
+"""
+reusable connections to the sqlite database files
+"""
+
+import atexit
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class ConnectionPool:
+    """Keeps connections open between calls, keyed by db_file
+
+    Every thread gets its own reader connection for each db_file. Writes to a
+    db_file all go through a single writer connection which is only handed to
+    one thread at a time.
+
+    In memory databases are not supported since every connection to
+    ":memory:" opens a different database.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._readers: Dict[str, List[sqlite3.Connection]] = {}
+        self._writers: Dict[str, sqlite3.Connection] = {}
+        self._writer_locks: Dict[str, threading.RLock] = {}
+        # bumped when the connections to a db_file are closed so that
+        # threads know to reopen their reader
+        self._generations: Dict[str, int] = {}
+
+    def _thread_readers(self) -> Dict[str, Tuple[sqlite3.Connection, int]]:
+        if not hasattr(self._local, "readers"):
+            self._local.readers = {}
+        return self._local.readers
+
+    @contextmanager
+    def reader(self, db_file: str) -> Iterator[sqlite3.Connection]:
+        """Borrow this thread's reading connection to the db_file"""
+        readers = self._thread_readers()
+        generation = self._generations.get(db_file, 0)
+        conn, conn_generation = readers.get(db_file, (None, generation))
+        if conn is None or conn_generation != generation:
+            # connections are only used by the thread which opened them, the
+            # check is turned off so that close can be called from any thread
+            conn = sqlite3.connect(db_file, check_same_thread=False)
+            with self._lock:
+                self._readers.setdefault(db_file, []).append(conn)
+                readers[db_file] = (conn, self._generations.get(db_file, 0))
+
+        yield conn
+
+    @contextmanager
+    def writer(self, db_file: str) -> Iterator[sqlite3.Connection]:
+        """Borrow the writing connection to the db_file
+
+        The work done with the connection is committed when the block exits
+        and rolled back if it raises.
+        """
+        with self._lock:
+            lock = self._writer_locks.setdefault(db_file, threading.RLock())
+
+        with lock:
+            conn = self._writers.get(db_file)
+            if conn is None:
+                conn = sqlite3.connect(db_file, check_same_thread=False)
+                self._writers[db_file] = conn
+
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            else:
+                conn.commit()
+
+    def close(self, db_file: Optional[str] = None) -> None:
+        """Close the connections to db_file, or to every file when not given"""
+        with self._lock:
+            db_files = [db_file] if db_file else list(self._readers | self._writers)
+            for name in db_files:
+                for conn in self._readers.pop(name, []):
+                    conn.close()
+                conn = self._writers.pop(name, None)
+                if conn is not None:
+                    conn.close()
+                self._generations[name] = self._generations.get(name, 0) + 1
+
+
+pool = ConnectionPool()
+atexit.register(pool.close)
+
+
+def reader(db_file: str):
+    """Borrow a reading connection from the shared pool"""
+    return pool.reader(db_file)
+
+
+def writer(db_file: str):
+    """Borrow the writing connection from the shared pool"""
+    return pool.writer(db_file)
+
+
+def close_connections(db_file: Optional[str] = None) -> None:
+    """Close the shared pool's connections"""
+    pool.close(db_file)
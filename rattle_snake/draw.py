@@ -1,4 +1,6 @@
 import matplotlib.pyplot as plt
+import numpy as np
+from matplotlib.collections import LineCollection
 
 
 def draw_pop_center(ax, x, y, color, marker):
@@ -29,3 +31,20 @@ def draw_edge(ax, x_values, y_values):
         alpha=0.5,
         linewidth=0.5,
     )
+
+
+def draw_edges(ax, segments: np.ndarray):
+    """Draw all the edges as a single collection
+
+    segments has shape (num_edges, 2, 2), the start and end x, y of each edge.
+    The edges take the colors of the axes color cycle like draw_edge.
+    """
+    colors = plt.rcParams["axes.prop_cycle"].by_key()["color"]
+    ax.add_collection(
+        LineCollection(
+            segments,
+            colors=[colors[i % len(colors)] for i in range(len(segments))],
+            alpha=0.5,
+            linewidths=0.5,
+        )
+    )
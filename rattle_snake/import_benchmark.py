@@ -0,0 +1,94 @@
+"""
+Run this script to time importing the core modules
+
+    poetry run python -m rattle_snake.import_benchmark --repeats 5 --output imports.jsonl
+
+Every module is imported in a fresh interpreter. Besides the time taken the
+heavy libraries it pulled in are recorded, and the script exits with an
+error when a core module imports one of them so that it stays lightweight.
+"""
+import json
+import subprocess
+import sys
+from typing import Dict, List
+
+import click
+
+
+# reading planes, from SQLite, bundles or shared memory, only needs numpy
+CORE_MODULES = [
+    "rattle_snake.tables",
+    "rattle_snake.db_helpers",
+    "rattle_snake.plane_bundle",
+    "rattle_snake.shared_plane",
+    "rattle_snake.plane_map",
+]
+HEAVY_MODULES = ["matplotlib", "scipy", "streamlit", "click"]
+
+IMPORT_SCRIPT = """
+import importlib, json, sys, time
+start = time.perf_counter()
+importlib.import_module(sys.argv[1])
+seconds = time.perf_counter() - start
+heavy = [name for name in sys.argv[2:] if name in sys.modules]
+print(json.dumps({"seconds": seconds, "heavy_modules": heavy}))
+"""
+
+
+def time_import(module: str) -> Dict:
+    """Import the module in a new interpreter"""
+    completed = subprocess.run(
+        [sys.executable, "-c", IMPORT_SCRIPT, module, *HEAVY_MODULES],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(completed.stdout)
+
+
+def run_import_benchmark(modules: List[str], repeats: int) -> List[Dict]:
+    # imported here, the benchmark module itself loads matplotlib
+    from rattle_snake.benchmark import environment
+
+    env = environment()
+    results = []
+    for module in modules:
+        for repeat in range(repeats):
+            results.append(
+                {"module": module, "repeat": repeat, **time_import(module), **env}
+            )
+
+    return results
+
+
+@click.command()
+@click.option(
+    "--module", "modules", multiple=True, default=CORE_MODULES, help="Module to import"
+)
+@click.option("--repeats", default=3, help="Imports of each module")
+@click.option("--output", type=click.Path(), help="JSON lines file for the results")
+def main(modules, repeats, output):
+    """Time importing each module and check it doesn't load heavy libraries"""
+    results = run_import_benchmark(list(modules), repeats)
+
+    lines = [json.dumps(result) for result in results]
+    if output:
+        with open(output, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        click.echo(f"wrote {len(results)} results to {output}")
+    else:
+        click.echo("\n".join(lines))
+
+    heavy = {
+        result["module"]: result["heavy_modules"]
+        for result in results
+        if result["heavy_modules"]
+    }
+    for module, heavy_modules in heavy.items():
+        click.echo(f"{module} imports {', '.join(heavy_modules)}", err=True)
+    if heavy:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
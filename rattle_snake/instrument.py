@@ -0,0 +1,67 @@
+"""
+timing spans and counters for the phases of map generation
+"""
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+
+logger = logging.getLogger(__name__)
+
+
+class Instrumentation:
+    """Collects how long each phase takes and counts events inside them
+
+    Spans with the same name add up, e.g. the support generation span is
+    entered once per stratum. A caller can read the numbers back with
+    timings and counters or export everything with to_dict and to_json.
+    """
+
+    def __init__(self):
+        self.spans: Dict[str, List[float]] = defaultdict(list)
+        self.counters: Dict[str, int] = Counter()
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """Time the block as one occurrence of the named span"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.spans[name].append(seconds)
+            logger.debug("%s took %.6f seconds", name, seconds)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """Add amount to the named counter"""
+        self.counters[name] += amount
+
+    def timings(self) -> Dict[str, float]:
+        """Total seconds spent in each span"""
+        return {name: sum(durations) for name, durations in self.spans.items()}
+
+    def to_dict(self) -> Dict:
+        return {
+            "spans": {
+                name: {"seconds": sum(durations), "calls": len(durations)}
+                for name, durations in self.spans.items()
+            },
+            "counters": dict(self.counters),
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict())
+
+    def reset(self) -> None:
+        self.spans.clear()
+        self.counters.clear()
+
+    def log_summary(self, level: int = logging.INFO) -> None:
+        """Log the total of every span and counter"""
+        for name, seconds in self.timings().items():
+            logger.log(level, "%s: %.6f seconds", name, seconds)
+        for name, value in self.counters.items():
+            logger.log(level, "%s: %d", name, value)
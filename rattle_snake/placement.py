@@ -0,0 +1,158 @@
+"""
+placement of the population centers of a stratum
+"""
+import logging
+import math
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+# candidates drawn per batch
+PLACEMENT_BATCH_SIZE = 64
+# candidates drawn per requested population center before giving up
+ATTEMPTS_PER_CENTER = 2000
+
+
+class InfeasiblePlacementError(ValueError):
+    """Raised when the population centers don't fit in their annulus"""
+
+    def __init__(
+        self, message: str, requested: int, placed: int, capacity: int, attempts: int
+    ):
+        super().__init__(message)
+        self.requested = requested
+        self.placed = placed
+        self.capacity = capacity
+        self.attempts = attempts
+
+
+def annulus_capacity(inner: float, outer: float, min_dist: float) -> int:
+    """Upper bound on the points of an annulus which are min_dist apart
+
+    Disks of radius min_dist / 2 around the points don't overlap and lie in
+    the annulus grown by min_dist / 2, no packing of such disks is denser
+    than the hexagonal one.
+    """
+    grown_area = np.pi * ((outer + min_dist / 2) ** 2 - max(inner - min_dist / 2, 0) ** 2)
+    return int(grown_area * 2 / (np.sqrt(3) * min_dist**2))
+
+
+class SpatialHash:
+    """Grid of cells as wide as min_dist holding the accepted points
+
+    A point closer than min_dist to another one is in the same or in one of
+    the 8 neighbouring cells, so a check looks at a constant number of
+    points instead of all of them.
+    """
+
+    def __init__(self, min_dist: float):
+        self.min_dist = min_dist
+        self.cells: Dict[Tuple[int, int], List[Tuple[float, float]]] = defaultdict(list)
+
+    def _cell(self, x: float, y: float) -> Tuple[int, int]:
+        return math.floor(x / self.min_dist), math.floor(y / self.min_dist)
+
+    def add(self, x: float, y: float) -> None:
+        self.cells[self._cell(x, y)].append((x, y))
+
+    def is_free(self, x: float, y: float) -> bool:
+        """Whether no point is closer than min_dist"""
+        cell_x, cell_y = self._cell(x, y)
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for other_x, other_y in self.cells.get((cell_x + dx, cell_y + dy), ()):
+                    if math.hypot(x - other_x, y - other_y) < self.min_dist:
+                        return False
+        return True
+
+
+def place_population_centers(
+    rng: np.random.Generator,
+    inner: float,
+    outer: float,
+    num_pop_centers: int,
+    min_dist: float,
+    existing_xys: Optional[Sequence[Tuple[float, float]]] = None,
+    batch_size: int = PLACEMENT_BATCH_SIZE,
+    attempts_per_center: int = ATTEMPTS_PER_CENTER,
+) -> Tuple[np.ndarray, np.ndarray, int]:
+    """Place population centers at least min_dist from each other
+
+    The polar coordinates of candidates are drawn uniformly, the radius from
+    [inner, outer] and the angle from [0, 2 pi], in batches. Going through a
+    batch in order a candidate is kept when it is far enough from the points
+    kept before it, which gives the same layout as drawing one candidate at
+    a time until it fits.
+
+    Args:
+        rng (np.random.Generator): Random generator of the plane
+        inner (float): Smallest radius of a population center
+        outer (float): Largest radius of a population center
+        num_pop_centers (int): Number of population centers to place
+        min_dist (float): Smallest distance between population centers
+        existing_xys (list): Points the new centers keep min_dist away from
+        batch_size (int): Number of candidates drawn at once
+        attempts_per_center (int): Candidates drawn per population center
+            before the placement is given up
+
+    Returns:
+        The radii and angles of the population centers and the number of
+        rejected candidates.
+
+    Raises:
+        InfeasiblePlacementError: When the centers can't fit in the annulus
+            or weren't placed within the budget of candidates
+    """
+    existing_xys = list(existing_xys or [])
+    grid = SpatialHash(min_dist)
+    for x, y in existing_xys:
+        grid.add(x, y)
+
+    capacity = annulus_capacity(inner, outer, min_dist)
+    num_existing = sum(1 for x, y in existing_xys if inner <= math.hypot(x, y) <= outer)
+    if num_existing + num_pop_centers > capacity:
+        raise InfeasiblePlacementError(
+            f"{num_pop_centers} population centers {min_dist} apart don't fit "
+            f"in the annulus [{inner}, {outer}] holding {num_existing}, "
+            f"at most {capacity} fit",
+            requested=num_pop_centers,
+            placed=0,
+            capacity=capacity,
+            attempts=0,
+        )
+
+    lengths = []
+    angles = []
+    max_attempts = attempts_per_center * num_pop_centers
+    attempts = 0
+    while len(lengths) < num_pop_centers and attempts < max_attempts:
+        size = min(batch_size, max_attempts - attempts)
+        candidate_lengths = rng.uniform(inner, outer, size)
+        candidate_angles = np.pi * rng.uniform(0, 2, size)
+        candidate_xs = candidate_lengths * np.cos(candidate_angles)
+        candidate_ys = candidate_lengths * np.sin(candidate_angles)
+        for i, (x, y) in enumerate(zip(candidate_xs.tolist(), candidate_ys.tolist())):
+            attempts += 1
+            if grid.is_free(x, y):
+                grid.add(x, y)
+                lengths.append(candidate_lengths[i])
+                angles.append(candidate_angles[i])
+                if len(lengths) == num_pop_centers:
+                    break
+
+    if len(lengths) < num_pop_centers:
+        raise InfeasiblePlacementError(
+            f"placed {len(lengths)} of {num_pop_centers} population centers "
+            f"{min_dist} apart in the annulus [{inner}, {outer}] with "
+            f"{attempts} candidates, at most {capacity} fit",
+            requested=num_pop_centers,
+            placed=len(lengths),
+            capacity=capacity,
+            attempts=attempts,
+        )
+
+    return np.array(lengths), np.array(angles), attempts - num_pop_centers
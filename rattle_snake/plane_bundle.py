@@ -0,0 +1,154 @@
+"""
+memory mappable export of a plane's node and edge tables
+
+A bundle is a directory holding the structured arrays of the tables as
+.npy files and a small JSON header:
+
+    metadata.json
+    nodes.npy
+    edges.npy
+
+Opening a bundle maps the arrays read only, no rows are parsed or copied.
+"""
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Tuple
+
+import numpy as np
+
+from rattle_snake.db_helpers import get_num_circles, load_plane_nodes, load_plane_edges
+from rattle_snake.tables import NodeTable, EdgeTable
+
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_FORMAT_VERSION = 1
+METADATA_FILE = "metadata.json"
+NODES_FILE = "nodes.npy"
+EDGES_FILE = "edges.npy"
+
+
+def _replace_atomically(path: str, write) -> None:
+    """Write the file next to path and move it into place"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def export_plane(
+    directory: str,
+    nodes: NodeTable,
+    edges: EdgeTable,
+    num_circles: int,
+    stratum_radii: float,
+) -> Dict:
+    """Write the tables of a plane as a bundle
+
+    The metadata is written last, so a bundle is only opened once all of
+    its arrays are complete.
+
+    Returns:
+        The metadata of the bundle
+    """
+    os.makedirs(directory, exist_ok=True)
+    metadata = {
+        "format_version": BUNDLE_FORMAT_VERSION,
+        "plane": nodes.plane,
+        "num_circles": num_circles,
+        "stratum_radii": stratum_radii,
+        "num_nodes": len(nodes),
+        "num_edges": len(edges),
+    }
+
+    # np.save writes the array as it is laid out in memory
+    _replace_atomically(
+        os.path.join(directory, NODES_FILE),
+        lambda f: np.save(f, np.ascontiguousarray(nodes.data)),
+    )
+    _replace_atomically(
+        os.path.join(directory, EDGES_FILE),
+        lambda f: np.save(f, np.ascontiguousarray(edges.data)),
+    )
+    _replace_atomically(
+        os.path.join(directory, METADATA_FILE),
+        lambda f: f.write(json.dumps(metadata, indent=2).encode()),
+    )
+    logger.info(
+        "exported %d nodes and %d edges of %s to %s",
+        len(nodes),
+        len(edges),
+        nodes.plane,
+        directory,
+    )
+
+    return metadata
+
+
+def read_metadata(directory: str) -> Dict:
+    with open(os.path.join(directory, METADATA_FILE)) as f:
+        metadata = json.load(f)
+
+    if metadata.get("format_version") != BUNDLE_FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported bundle format {metadata.get('format_version')} in {directory}"
+        )
+    return metadata
+
+
+def open_plane(directory: str) -> Tuple[NodeTable, EdgeTable, Dict]:
+    """Map the tables of a bundle read only
+
+    Returns:
+        The node table, the edge table and the metadata of the bundle
+    """
+    metadata = read_metadata(directory)
+    plane = metadata["plane"]
+    node_data = np.load(os.path.join(directory, NODES_FILE), mmap_mode="r")
+    edge_data = np.load(os.path.join(directory, EDGES_FILE), mmap_mode="r")
+    if (
+        len(node_data) != metadata["num_nodes"]
+        or len(edge_data) != metadata["num_edges"]
+    ):
+        raise ValueError(f"The arrays in {directory} don't match its metadata")
+
+    return NodeTable(node_data, plane), EdgeTable(edge_data, plane), metadata
+
+
+def export_plane_from_db(db_file: str, plane: str, directory: str) -> Dict:
+    """Export a plane stored in the database as a bundle"""
+    # imported here, plane_map imports this module
+    from rattle_snake.plane_map import STRATUM_RADII
+
+    nodes = NodeTable(load_plane_nodes(db_file, plane), plane)
+    edges = EdgeTable(load_plane_edges(db_file, plane), plane)
+    return export_plane(
+        directory, nodes, edges, get_num_circles(db_file, plane), STRATUM_RADII
+    )
+
+
+def main():
+    """Export a plane from the database as a memory mappable bundle"""
+    # click is only needed on the command line, not to open bundles
+    import click
+
+    @click.command()
+    @click.option("--db-file", required=True, help="Database the plane is read from")
+    @click.option("--plane", required=True, help="Plane to export, e.g. weird_science")
+    @click.option("--output", required=True, type=click.Path(), help="Bundle directory")
+    def export(db_file, plane, output):
+        """Export a plane from the database as a memory mappable bundle"""
+        logging.basicConfig(level=logging.INFO)
+        export_plane_from_db(db_file, plane, output)
+
+    export()
+
+
+if __name__ == "__main__":
+    main()
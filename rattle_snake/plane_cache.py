@@ -0,0 +1,148 @@
+"""
+on disk cache of generated planes keyed by their generation parameters
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+
+from rattle_snake.tables import NodeTable, EdgeTable
+
+
+logger = logging.getLogger(__name__)
+
+# bump whenever a change to the generation code changes the generated planes
+GENERATION_VERSION = 3
+
+
+def plane_cache_key(
+    plane: str,
+    num_circles: int,
+    center_k: int,
+    k: int,
+    min_support: int,
+    max_support: int,
+    seed: int,
+    version: int = GENERATION_VERSION,
+) -> str:
+    """Hash of everything that determines a generated plane"""
+    params = {
+        "plane": plane,
+        "num_circles": num_circles,
+        "center_k": center_k,
+        "k": k,
+        "min_support": min_support,
+        "max_support": max_support,
+        "seed": seed,
+        "version": version,
+    }
+    encoded = json.dumps(params, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class PlaneCache:
+    """Generated planes stored as .npz files named after their cache key
+
+    The node and edge tables are written as their structured arrays. When
+    the files in the directory grow beyond max_bytes the least recently
+    used planes are removed.
+    """
+
+    suffix = ".npz"
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 2**20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + self.suffix)
+
+    def get(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """The arrays stored under key, None on a cache miss"""
+        path = self._path(key)
+        try:
+            with np.load(path) as stored:
+                arrays = {name: stored[name] for name in stored.files}
+        except (FileNotFoundError, ValueError, OSError) as e:
+            if not isinstance(e, FileNotFoundError):
+                logger.warning("ignoring unreadable cache entry %s: %s", path, e)
+            return None
+
+        # the modification time orders the entries for eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        logger.debug("plane cache hit %s", key)
+        return arrays
+
+    def get_plane(self, key: str, plane: str):
+        """The node table, edge table and bridging edge ids stored under key"""
+        arrays = self.get(key)
+        if arrays is None:
+            return None
+        return (
+            NodeTable(arrays["nodes"], plane),
+            EdgeTable(arrays["edges"], plane),
+            arrays["bridging_edge_ids"],
+        )
+
+    def put(self, key: str, **arrays: np.ndarray) -> None:
+        """Store the arrays under key, replacing any previous entry"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def put_plane(
+        self,
+        key: str,
+        nodes: NodeTable,
+        edges: EdgeTable,
+        bridging_edge_ids: np.ndarray,
+    ) -> None:
+        self.put(
+            key,
+            nodes=nodes.data,
+            edges=edges.data,
+            bridging_edge_ids=np.asarray(bridging_edge_ids, dtype=np.int64),
+        )
+
+    def evict(self) -> None:
+        """Remove the least recently used entries until under max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                # other processes sharing the directory may remove entries
+                try:
+                    stat = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+            logger.debug("evicted %s from the plane cache", name)
+
+    def clear(self) -> None:
+        for name in os.listdir(self.directory):
+            if name.endswith(self.suffix):
+                os.remove(os.path.join(self.directory, name))
@@ -1,34 +1,41 @@
 """
 draw the concentric circles
 """
-from typing import List, Tuple
-from datetime import datetime
-import matplotlib.pyplot as plt
+import logging
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
 import numpy as np
-import networkx as nx
-import click
 
 from rattle_snake.constants import BeingCulture
-from rattle_snake.draw import draw_pop_center, draw_support_node, draw_edge
-from rattle_snake.node import Node, node_dist
-from rattle_snake.edge import Edge
-from rattle_snake.cluster import (
-    Cluster,
-    find_closest_nodes,
-    find_closest_nodes_between_clusters,
-)
+from rattle_snake.tables import NodeTable, EdgeTable
+from rattle_snake.instrument import Instrumentation
+from rattle_snake.placement import place_population_centers
+from rattle_snake.plane_cache import PlaneCache, plane_cache_key
+from rattle_snake.plane_bundle import export_plane, open_plane
+from rattle_snake.shared_plane import SharedPlane
+from rattle_snake.cluster import ClusterIndex
 from rattle_snake.db_helpers import (
+    BULK_BATCH_SIZE,
+    BulkWriteStats,
+    bulk_write,
     db_setup,
     generate_sqlite_db_file,
-    create_node,
-    create_edge,
-    create_connection,
+    get_max_ids,
     get_num_circles,
-    get_plane_nodes,
-    get_plane_edges,
-    get_node_x_y,
+    load_plane_nodes,
+    load_plane_edges,
+    refresh_resource_aggregates,
+    save_population_center_routes,
 )
 
+# scipy and matplotlib are imported when a map is routed or drawn, so that
+# loading a map doesn't pay for them
+if TYPE_CHECKING:
+    from rattle_snake.routing import Router
+    from rattle_snake.territory import TerritoryIndex
+
+logger = logging.getLogger(__name__)
+
 
 def xy_dist(x1, y1, x2, y2):
     return np.sqrt((y2 - y1) ** 2 + (x2 - x1) ** 2)
@@ -50,6 +57,165 @@ def min_dist_to_list(
     return min_dist
 
 
+STRATUM_RADII = 2.0
+
+# this delta keeps the generated nodes farther away from the boundary
+BOUNDARY_DELTA = 0.3
+
+
+def stratum_boundaries(num_circles: int) -> List[Tuple[float, float]]:
+    """Inner and outer radius of each stratum"""
+    return [((i) * STRATUM_RADII, (i + 1) * STRATUM_RADII) for i in range(num_circles)]
+
+
+def generate_stratum(
+    rng: np.random.Generator,
+    plane: str,
+    stratum_num: int,
+    bounds: Tuple[float, float],
+    num_pop_centers: int,
+    min_support: int,
+    max_support: int,
+    node_id: int,
+    edge_id: int,
+    instrumentation: Instrumentation,
+    pop_center_xys: Optional[List[Tuple[float, float]]] = None,
+) -> Tuple[NodeTable, EdgeTable]:
+    """Generate the clusters of one stratum
+
+    The population centers are placed in the stratum's ring and each is
+    surrounded by its supporting nodes, which are connected to it.
+
+    Args:
+        rng (np.random.Generator): Random generator of the plane
+        plane (str): Plane the nodes belong to
+        stratum_num (int): Number of the stratum, starting at 1 in the center
+        bounds (tuple): Inner and outer radius of the stratum
+        num_pop_centers (int): Number of population centers in the stratum
+        min_support (int): Minimum number of supporting nodes per population center
+        max_support (int): Maximum number of supporting nodes per population center
+        node_id (int): Id of the first generated node
+        edge_id (int): Id of the first generated edge
+        instrumentation (Instrumentation): Collects the timings and counters
+        pop_center_xys (list): Population centers already in the stratum,
+            the new ones keep the same minimum distance to them
+
+    Returns:
+        The nodes and the edges of the stratum. The ids are consecutive from
+        node_id and edge_id, each population center is followed by its
+        supporting nodes.
+    """
+    # initialize as a node at the origin
+    this_stratum_pop_center_xys = [(0, 0)]
+    if pop_center_xys is not None:
+        this_stratum_pop_center_xys.extend(pop_center_xys)
+
+    # the population centers are kept this far from each other
+    min_radial_dist = stratum_num - 1 + 0.6
+
+    # generate the pop centers
+    with instrumentation.span("pop_center_sampling"):
+        lengths, angles, num_rejected = place_population_centers(
+            rng,
+            bounds[0] + BOUNDARY_DELTA,
+            bounds[1] - BOUNDARY_DELTA,
+            num_pop_centers,
+            min_radial_dist,
+            existing_xys=this_stratum_pop_center_xys,
+        )
+    instrumentation.count("pop_center_retries", num_rejected)
+
+    with instrumentation.span("support_generation"):
+        # yeild is fixed at 100 for now
+        pop_center_resource_yeilds = rng.integers(100, 200, num_pop_centers)
+        num_supports = rng.integers(min_support, max_support + 1, num_pop_centers)
+        # the cluster of every supporting node, clusters are kept together
+        support_clusters = np.repeat(np.arange(num_pop_centers), num_supports)
+
+        # controls how close the points are
+        length_delta = 0.1
+        angle_delta = np.pi / 8
+        support_lengths = rng.uniform(
+            lengths[support_clusters] - length_delta,
+            lengths[support_clusters] + length_delta,
+        )
+        support_angles = rng.uniform(
+            angles[support_clusters] - angle_delta,
+            angles[support_clusters] + angle_delta,
+        )
+        support_yeilds = pop_center_resource_yeilds[support_clusters]
+        support_resource_yeilds = rng.integers(
+            (support_yeilds * 0.1).astype(np.int64),
+            (support_yeilds * 0.6).astype(np.int64),
+        )
+
+        pop_center_xs = lengths * np.cos(angles)
+        pop_center_ys = lengths * np.sin(angles)
+        support_xs = support_lengths * np.cos(support_angles)
+        support_ys = support_lengths * np.sin(support_angles)
+        # all supporting nodes are connected to their
+        # corresponding population center
+        edge_lengths = np.hypot(
+            support_xs - pop_center_xs[support_clusters],
+            support_ys - pop_center_ys[support_clusters],
+        )
+
+        # ids are assigned in ranges, each population center is followed by
+        # its supporting nodes. a population center's node_id is the same
+        # as it's cluster id
+        cluster_starts = np.cumsum(num_supports + 1) - num_supports - 1
+        support_starts = np.cumsum(num_supports) - num_supports
+        pop_center_ids = node_id + cluster_starts
+        support_ids = (
+            pop_center_ids[support_clusters]
+            + 1
+            + np.arange(len(support_clusters))
+            - support_starts[support_clusters]
+        )
+        edge_ids = edge_id + np.arange(len(support_clusters))
+
+        # the rows are in id order
+        nodes = NodeTable.empty(len(pop_center_ids) + len(support_ids), plane)
+        pop_center_rows = cluster_starts
+        support_node_rows = support_ids - node_id
+        for column, pop_center_values, support_values in (
+            ("node_id", pop_center_ids, support_ids),
+            ("x", pop_center_xs, support_xs),
+            ("y", pop_center_ys, support_ys),
+            ("cluster_id", pop_center_ids, pop_center_ids[support_clusters]),
+            ("is_population_center", True, False),
+            ("resource_yeild", pop_center_resource_yeilds, support_resource_yeilds),
+        ):
+            nodes.data[column][pop_center_rows] = pop_center_values
+            nodes.data[column][support_node_rows] = support_values
+        nodes.data["stratum_id"] = stratum_num
+
+        edges = EdgeTable.empty(len(support_ids), plane)
+        edges.data["edge_id"] = edge_ids
+        edges.data["start_node_id"] = pop_center_ids[support_clusters]
+        edges.data["end_node_id"] = support_ids
+        edges.data["length"] = edge_lengths
+
+    return nodes, edges
+
+
+def link_edges(
+    nodes: NodeTable, sources: np.ndarray, targets: np.ndarray, edge_id: int
+) -> EdgeTable:
+    """Edges between the nodes at the rows sources and targets
+
+    The ids are consecutive from edge_id.
+    """
+    edges = EdgeTable.empty(len(sources), nodes.plane)
+    edges.data["edge_id"] = edge_id + np.arange(len(sources))
+    edges.data["start_node_id"] = nodes.node_id[sources]
+    edges.data["end_node_id"] = nodes.node_id[targets]
+    edges.data["length"] = xy_dist(
+        nodes.x[sources], nodes.y[sources], nodes.x[targets], nodes.y[targets]
+    )
+    return edges
+
+
 class PlaneMap:
     """Class for holding the map a plane of existence.
 
@@ -73,6 +239,16 @@ class PlaneMap:
         db_file: str = "",
         being_culture: BeingCulture = BeingCulture.WEIRD,
         num_circles: int = 4,
+        center_k: int = 3,
+        k: int = 7,
+        min_support: int = 3,
+        max_support: int = 10,
+        instrumentation: Optional[Instrumentation] = None,
+        seed: Optional[int] = None,
+        rng: Optional[np.random.Generator] = None,
+        cache: Optional[PlaneCache] = None,
+        bundle: str = "",
+        shared: Optional[SharedPlane] = None,
     ):
         """Sets up the plane map
 
@@ -83,108 +259,408 @@ class PlaneMap:
             num_circles (int): Number of tiered circles to draw
             create_new_nodes (bool): Indicates whether to load existing or create new nodes.
             db_file (str): Path to a db_file
+            center_k (int): Number of population centers in the central stratum
+            k (int): Number of population centers in the other strata
+            min_support (int): Minimum number of supporting nodes per population center
+            max_support (int): Maximum number of supporting nodes per population center
+            instrumentation (Instrumentation): Collects the timings and counters
+                of the map's phases, a new one is made when not given
+            seed (int): Seed of the random generator used to generate the map
+            rng (np.random.Generator): Random generator used instead of seed
+            cache (PlaneCache): Cache of generated maps, only used with a seed
+            bundle (str): Path to a bundle written by save_bundle, the map is
+                memory mapped from it instead of loaded from db_file
+            shared (SharedPlane): Plane attached from shared memory, the map
+                uses its read only tables without copying them
         """
         self.being_culture = being_culture
-        if db_file:
+        self.instrumentation = instrumentation or Instrumentation()
+        self.seed = seed
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        if shared is not None:
+            self.load_shared(shared)
+        elif bundle:
+            self.load_bundle(bundle)
+        elif db_file:
             self.num_circles = get_num_circles(db_file, self.being_culture.value)
             self.load_map(db_file=db_file)
         else:
             self.num_circles = num_circles
-            self.__generate_map()
+            generation_params = dict(
+                center_k=center_k, k=k, min_support=min_support, max_support=max_support
+            )
+            # a map is only determined by its parameters when it is seeded
+            if cache is None or seed is None or rng is not None:
+                self.__generate_map(**generation_params)
+            else:
+                self._generate_map_cached(cache, generation_params)
+
+    @property
+    def router(self) -> "Router":
+        """Routing engine over the current nodes and edges
+
+        The router and its cache are rebuilt when the nodes or edges change.
+        """
+        from rattle_snake.routing import Router
+
+        router = getattr(self, "_router", None)
+        if router is None or not router.is_for(self.nodes, self.edges):
+            router = Router(self.nodes, self.edges)
+            self._router = router
+        return router
+
+    @property
+    def territory(self) -> "TerritoryIndex":
+        """Index of which cluster owns each point of the plane
+
+        The index is rebuilt when the nodes change.
+        """
+        from rattle_snake.territory import TerritoryIndex
+
+        outer_radius = self.num_circles * self.stratum_radii
+        territory = getattr(self, "_territory", None)
+        if territory is None or not territory.is_for(self.nodes, outer_radius):
+            territory = TerritoryIndex(self.nodes, outer_radius=outer_radius)
+            self._territory = territory
+        return territory
 
     def save_fig(self):
         """Save an image of the map in is current state"""
-        plt.savefig(self.title)
+        self.fig.savefig(self.title)
+
+    def save_to_db(
+        self,
+        db_file: str = "",
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        batch_size: int = BULK_BATCH_SIZE,
+        population_center_routes: bool = False,
+    ) -> BulkWriteStats:
+        """Save the nodes and edges to the database in a single transaction
 
-    def save_to_db(self, db_file: str = ""):
-        """Save the nodes and edges to the database"""
+        Args:
+            db_file (str): Path to a db_file, a new one is created when empty
+            journal_mode (str): sqlite journal mode used for the write
+            synchronous (str): sqlite synchronous level used for the write
+            batch_size (int): Number of rows inserted per executemany call
+            population_center_routes (bool): Also save the route lengths and
+                next hops between every pair of population centers
+        """
         # create db if it doesn't already exist
         if not db_file:
             db_file = generate_sqlite_db_file()
             db_setup(db_file=db_file)
 
-        conn = create_connection(db_file)
-        # save nodes to db
-        for node in self.nodes:
-            node = (
-                node.node_id,
-                node.x,
-                node.y,
-                self.being_culture.value,
-                node.stratum_id,
-                node.node_id,
-                node.is_population_center,
-                node.resource_yeild,
+        with self.instrumentation.span("db_write"):
+            stats = bulk_write(
+                db_file,
+                self.nodes.to_db_rows(),
+                self.edges.to_db_rows(),
+                journal_mode=journal_mode,
+                synchronous=synchronous,
+                batch_size=batch_size,
             )
-            create_node(conn, node)
-
-        conn = create_connection(db_file)
-        # save edges to db
-        for edge in self.edges:
-            edge = (
-                edge.edge_id,
-                edge.start_node_id,
-                edge.end_node_id,
-                edge.plane,
-                edge.length,
-            )
-            create_edge(conn, edge)
+        self.instrumentation.count("rows_written", stats.num_nodes + stats.num_edges)
+
+        # the cluster and stratum resource totals are kept with the nodes
+        with self.instrumentation.span("resource_aggregates"):
+            refresh_resource_aggregates(db_file, self.being_culture.value)
+
+        if population_center_routes:
+            with self.instrumentation.span("population_center_routes"):
+                pop_center_ids = self.nodes.node_id[self.nodes.is_population_center]
+                distances, next_hops = self.router.route_table(pop_center_ids)
+                save_population_center_routes(
+                    db_file,
+                    self.being_culture.value,
+                    pop_center_ids,
+                    distances,
+                    next_hops,
+                    batch_size=batch_size,
+                )
+
+        return stats
 
     def draw(self) -> None:
         """Draws the nodes and edges in their current state"""
+        with self.instrumentation.span("draw"):
+            self._draw()
+
+    def _draw(self) -> None:
+        from rattle_snake.draw import draw_pop_center, draw_support_node, draw_edges
+
         # stratum boundaries are setup here
         self._setup_plotting()
 
-        # draw nodes
-        print("drawing nodes")
-        for node in self.nodes:
-
-            if node.is_population_center:
-                draw_pop_center(
-                    self.ax,
-                    node.x,
-                    node.y,
-                    self.colors[node.stratum_id - 1],
-                    self.markers[node.stratum_id - 1],
-                )
-            else:
-                draw_support_node(
-                    self.ax,
-                    node.x,
-                    node.y,
-                    self.colors[node.stratum_id - 1],
-                    self.markers[node.stratum_id - 1],
-                )
-
-        # draw the edges
-        print("drawing edges")
-        for edge in self.edges:
-            start_node = [
-                node for node in self.nodes if node.node_id == edge.start_node_id
-            ][0]
-            start_x, start_y = start_node.x, start_node.y
+        # draw nodes, one scatter per stratum and type of node
+        logger.debug("drawing %d nodes", len(self.nodes))
+        nodes = self.nodes
+        for stratum_id in np.unique(nodes.stratum_id):
+            in_stratum = nodes.stratum_id == stratum_id
+            # styles repeat for planes with more strata than styles
+            color = self.colors[(stratum_id - 1) % len(self.colors)]
+            marker = self.markers[(stratum_id - 1) % len(self.markers)]
+
+            pop_centers = in_stratum & nodes.is_population_center
+            draw_pop_center(
+                self.ax, nodes.x[pop_centers], nodes.y[pop_centers], color, marker
+            )
 
-            end_node = [
-                node for node in self.nodes if node.node_id == edge.end_node_id
-            ][0]
-            end_x, end_y = end_node.x, end_node.y
+            support = in_stratum & ~nodes.is_population_center
+            draw_support_node(
+                self.ax, nodes.x[support], nodes.y[support], color, marker
+            )
 
-            x_values = [start_x, end_x]
-            y_values = [start_y, end_y]
+        # draw the edges
+        logger.debug("drawing %d edges", len(self.edges))
+        start = nodes.indices_of(self.edges.start_node_id)
+        end = nodes.indices_of(self.edges.end_node_id)
+        segments = np.stack(
+            [
+                np.column_stack([nodes.x[start], nodes.y[start]]),
+                np.column_stack([nodes.x[end], nodes.y[end]]),
+            ],
+            axis=1,
+        )
+        draw_edges(self.ax, segments)
+
+    def _setup_strata(self) -> None:
+        self.stratum_radii = STRATUM_RADII
+        self.stratum_boundaries = stratum_boundaries(self.num_circles)
+
+    def _generate_map_cached(self, cache: PlaneCache, generation_params: dict) -> None:
+        """Take the map from the cache, generating and caching it on a miss"""
+        plane = self.being_culture.value
+        key = plane_cache_key(
+            plane, self.num_circles, seed=self.seed, **generation_params
+        )
+        with self.instrumentation.span("cache_lookup"):
+            cached = cache.get_plane(key, plane)
+
+        if cached is None:
+            self.instrumentation.count("cache_misses")
+            self.__generate_map(**generation_params)
+            with self.instrumentation.span("cache_store"):
+                cache.put_plane(
+                    key, self.nodes, self.edges, self.bridging_edges.edge_id
+                )
+            return
 
-            draw_edge(self.ax, x_values, y_values)
+        self.instrumentation.count("cache_hits")
+        self._setup_strata()
+        self.nodes, self.edges, bridging_edge_ids = cached
+        self.bridging_edges = EdgeTable(
+            self.edges.data[self.edges.indices_of(bridging_edge_ids)], plane
+        )
 
     def load_map(self, db_file: str) -> None:
         """Load the map data from the given db"""
-        self.stratum_radii = 2.0
-        self.stratum_boundaries = [
-            ((i) * self.stratum_radii, (i + 1) * self.stratum_radii)
-            for i in range(self.num_circles)
+        self._setup_strata()
+
+        plane = self.being_culture.value
+        with self.instrumentation.span("load"):
+            self.nodes = NodeTable(load_plane_nodes(db_file, plane), plane)
+            self.edges = EdgeTable(load_plane_edges(db_file, plane), plane)
+
+    def add_stratum(
+        self,
+        k: int = 7,
+        min_support: int = 3,
+        max_support: int = 10,
+        db_file: str = "",
+    ) -> Tuple[NodeTable, EdgeTable]:
+        """Grow the plane by a stratum of k clusters around the outermost one
+
+        See add_clusters for how the new clusters are linked and saved. The
+        map keeps its strata when the new clusters can't be placed.
+        """
+        nodes = self.nodes
+        num_circles = self.num_circles
+        self.num_circles += 1
+        self._setup_strata()
+        try:
+            return self.add_clusters(
+                self.num_circles,
+                k,
+                min_support=min_support,
+                max_support=max_support,
+                db_file=db_file,
+            )
+        except Exception:
+            # the new stratum only exists once its clusters are in the map
+            if self.nodes is nodes:
+                self.num_circles = num_circles
+                self._setup_strata()
+            raise
+
+    def add_clusters(
+        self,
+        stratum_id: int,
+        num_clusters: int,
+        min_support: int = 3,
+        max_support: int = 10,
+        db_file: str = "",
+    ) -> Tuple[NodeTable, EdgeTable]:
+        """Add clusters to a stratum without changing the existing nodes and edges
+
+        The new population centers keep the minimum distance of the stratum
+        to the ones already there. Only the new clusters are linked to their
+        closest foreign node, and the connectivity is repaired starting from
+        the components of the existing plane, so its nodes aren't queried
+        again unless they are cut off from the rest of the plane.
+
+        Args:
+            stratum_id (int): Stratum of the new clusters, from 1 to num_circles
+            num_clusters (int): Number of clusters to add
+            min_support (int): Minimum number of supporting nodes per population center
+            max_support (int): Maximum number of supporting nodes per population center
+            db_file (str): Database the new nodes and edges are written to,
+                the ids continue from the largest ids in it. Nothing is
+                written when empty.
+
+        Returns:
+            The new nodes and edges
+        """
+        if not 1 <= stratum_id <= self.num_circles:
+            raise ValueError(
+                f"stratum_id must be between 1 and {self.num_circles}, got {stratum_id}"
+            )
+
+        plane = self.being_culture.value
+        nodes = self.nodes
+        edges = self.edges
+        orphans = np.setdiff1d(
+            nodes.cluster_id, nodes.cluster_id[nodes.is_population_center]
+        )
+        if len(orphans):
+            # db_setup repairs databases written before cluster ids were saved
+            raise ValueError(
+                f"Clusters of {plane} without a population center: "
+                f"{orphans[:5].tolist()}"
+            )
+        in_stratum = (nodes.stratum_id == stratum_id) & nodes.is_population_center
+        pop_center_xys = list(
+            zip(nodes.x[in_stratum].tolist(), nodes.y[in_stratum].tolist())
+        )
+
+        node_id = int(nodes.node_id.max(initial=0)) + 1
+        edge_id = int(edges.edge_id.max(initial=0)) + 1
+        if db_file:
+            max_node_id, max_edge_id = get_max_ids(db_file)
+            node_id = max(node_id, max_node_id + 1)
+            edge_id = max(edge_id, max_edge_id + 1)
+
+        new_nodes, new_edges = generate_stratum(
+            self.rng,
+            plane,
+            stratum_id,
+            self.stratum_boundaries[stratum_id - 1],
+            num_clusters,
+            min_support,
+            max_support,
+            node_id,
+            edge_id,
+            self.instrumentation,
+            pop_center_xys=pop_center_xys,
+        )
+        edge_id += len(new_edges)
+
+        all_nodes = nodes.concat(new_nodes)
+        cluster_index = ClusterIndex(all_nodes)
+
+        # the existing edges between clusters give the existing components
+        start_clusters = nodes.cluster_id[nodes.indices_of(edges.start_node_id)]
+        end_clusters = nodes.cluster_id[nodes.indices_of(edges.end_node_id)]
+        between = start_clusters != end_clusters
+        cluster_connections = [
+            np.column_stack([start_clusters[between], end_clusters[between]])
         ]
 
-        self.nodes = get_plane_nodes(db_file, self.being_culture.value)
+        with self.instrumentation.span("cluster_linking"):
+            # the new population centers come after the existing ones
+            num_all_clusters = len(cluster_index.cluster_ids)
+            new_labels = np.arange(num_all_clusters - num_clusters, num_all_clusters)
+            _, sources, targets, _ = cluster_index.nearest_foreign(
+                source_clusters=new_labels
+            )
+            links = link_edges(all_nodes, sources, targets, edge_id)
+            edge_id += len(links)
+            cluster_connections.append(
+                np.column_stack(
+                    [all_nodes.cluster_id[sources], all_nodes.cluster_id[targets]]
+                )
+            )
+
+        with self.instrumentation.span("connectivity_repair"):
+            sources, targets, _ = cluster_index.connect(
+                np.concatenate(cluster_connections), skip_largest=True
+            )
+            bridging_edges = link_edges(all_nodes, sources, targets, edge_id)
+
+        self.instrumentation.count("knn_queries", cluster_index.num_queries)
+        self.instrumentation.count("knn_query_points", cluster_index.num_query_points)
+        self.instrumentation.count("bridging_edges", len(bridging_edges))
+
+        new_edges = EdgeTable(
+            np.concatenate([new_edges.data, links.data, bridging_edges.data]), plane
+        )
+        self.nodes = all_nodes
+        self.edges = edges.concat(new_edges)
+        # maps loaded from a database don't know their bridging edges
+        if hasattr(self, "bridging_edges"):
+            bridging_edges = self.bridging_edges.concat(bridging_edges)
+        self.bridging_edges = bridging_edges
+        logger.info(
+            "added %d nodes and %d edges to stratum %d",
+            len(new_nodes),
+            len(new_edges),
+            stratum_id,
+        )
+
+        if db_file:
+            with self.instrumentation.span("db_write"):
+                stats = bulk_write(
+                    db_file, new_nodes.to_db_rows(), new_edges.to_db_rows()
+                )
+            self.instrumentation.count(
+                "rows_written", stats.num_nodes + stats.num_edges
+            )
+
+        return new_nodes, new_edges
+
+    def save_bundle(self, directory: str) -> None:
+        """Export the nodes and edges as a memory mappable bundle"""
+        with self.instrumentation.span("bundle_write"):
+            export_plane(
+                directory,
+                self.nodes,
+                self.edges,
+                self.num_circles,
+                self.stratum_radii,
+            )
+
+    def load_bundle(self, directory: str) -> None:
+        """Map the nodes and edges of a bundle read only"""
+        with self.instrumentation.span("load"):
+            self.nodes, self.edges, metadata = open_plane(directory)
 
-        self.edges = get_plane_edges(db_file, self.being_culture.value)
+        if metadata["plane"] != self.being_culture.value:
+            raise ValueError(
+                f"{directory} holds {metadata['plane']}, not {self.being_culture.value}"
+            )
+        self.num_circles = metadata["num_circles"]
+        self._setup_strata()
+
+    def load_shared(self, shared: SharedPlane) -> None:
+        """Use the read only tables of a plane attached from shared memory"""
+        if shared.plane != self.being_culture.value:
+            raise ValueError(
+                f"The shared plane is {shared.plane}, not {self.being_culture.value}"
+            )
+        self.nodes = shared.nodes
+        self.edges = shared.edges
+        self.num_circles = shared.num_circles
+        self._setup_strata()
 
     def __generate_map(
         self, center_k: int = 3, k: int = 7, min_support: int = 3, max_support: int = 10
@@ -199,218 +675,76 @@ class PlaneMap:
         forms a cluster which is enumerated by the node id
         of the population center. We random connect near by clusters
         """
-        self.clusters = []
-        self.nodes = []
-        self.edges = []
+        plane = self.being_culture.value
+        # the tables of the strata are joined at the end
+        stratum_nodes = []
+        stratum_edges = []
         # nodes setup
-        self.stratum_radii = 2.0
-        self.stratum_boundaries = [
-            ((i) * self.stratum_radii, (i + 1) * self.stratum_radii)
-            for i in range(self.num_circles)
-        ]
+        self._setup_strata()
 
-        # this delta keeps the generated nodes farther away from the boundary
-        boundary_delta = 0.3
-
-        stratum_num = 0
         # node id is the primary key of the nodes table
         node_id = 1
         edge_id = 1
-        for color_num, bounds in enumerate(self.stratum_boundaries):
-            print(f"stratum number {stratum_num}")
-            stratum_num += 1
-
-            # initialize as a node at the origin
-            this_stratum_pop_center_xys = [(0, 0)]
+        for stratum_num, bounds in enumerate(self.stratum_boundaries, 1):
+            logger.debug("generating stratum %d", stratum_num)
 
             if stratum_num == 1:
                 num_pop_centers = center_k
             else:
                 num_pop_centers = k
 
-            # generate the pop centers
-            for i in range(num_pop_centers):
-                length = np.random.uniform(
-                    bounds[0] + boundary_delta, bounds[1] - boundary_delta
-                )
-                print(f"length: {length}")
-                angle = np.pi * np.random.uniform(0, 2)
-
-                x = length * np.cos(angle)
-                y = length * np.sin(angle)
-
-                # if the newly generated population center is too close to any of the
-                # previously generated population centers
-                # then keep generating new candidates x and y until far enough away
-                min_radial_dist = stratum_num - 1 + 0.6
-
-                while (
-                    min_dist_to_list((x, y), this_stratum_pop_center_xys)
-                    < min_radial_dist
-                ):
-                    length = np.random.uniform(
-                        bounds[0] + boundary_delta, bounds[1] - boundary_delta
-                    )
-                    angle = np.pi * np.random.uniform(0, 2)
-
-                    x = length * np.cos(angle)
-                    y = length * np.sin(angle)
-                    print(f"Generating new x y candidate for pop center")
-
-                # store the new valid x, y pair
-                this_stratum_pop_center_xys.append((x, y))
-
-                # print(self.stratum_boundaries[i][0], self.stratum_boundaries[i][1])
-                print(i, ":", x, y)
-
-                # insert population center into the table
-                # is_population_center true == 1
-                # yeild is fixed at 100 for now
-                population_center_resource_yeild = np.random.randint(100, 200)
-                # a population center's node_id is the same as it's cluster id
-                pop_node = Node(
-                    node_id=node_id,
-                    x=x,
-                    y=y,
-                    plane=self.being_culture.value,
-                    stratum_id=stratum_num,
-                    cluster_id=node_id,
-                    is_population_center=True,
-                    resource_yeild=population_center_resource_yeild,
-                )
-
-                pop_center_id = node_id
-                pop_center_x = x
-                pop_center_y = y
-                node_id += 1
-                self.nodes.append(pop_node)
-
-                # generate supporting nodes
-                cluster_supporting_nodes = []
-                num_support = np.random.randint(min_support, max_support + 1)
-                for _ in range(num_support):
-                    # controls how close the points are
-                    length_delta = 0.1
-                    angle_delta = np.pi / 8
-                    l = np.random.uniform(length - length_delta, length + length_delta)
-                    a = np.random.uniform(angle - angle_delta, angle + angle_delta)
-
-                    x = l * np.cos(a)
-                    y = l * np.sin(a)
-
-                    yeild_delta = 50
-                    supporting_node_resource_yeild = np.random.randint(
-                        int(population_center_resource_yeild * 0.1),
-                        int(population_center_resource_yeild * 0.6),
-                    )
-                    # 0 for not a population center
-                    supp_node = Node(
-                        node_id=node_id,
-                        x=x,
-                        y=y,
-                        plane=self.being_culture.value,
-                        stratum_id=stratum_num,
-                        cluster_id=pop_center_id,
-                        is_population_center=False,
-                        resource_yeild=supporting_node_resource_yeild,
-                    )
-                    cluster_supporting_nodes.append(supp_node)
-                    # create_node(conn, node)
-
-                    # all supporting nodes are connected to their
-                    # corresponding population center
-                    edge = Edge(
-                        edge_id=edge_id,
-                        start_node_id=pop_center_id,
-                        end_node_id=node_id,
-                        plane=self.being_culture.value,
-                        length=node_dist(pop_node, supp_node),
-                    )
-
-                    edge_id += 1
-                    node_id += 1
-                    self.nodes.append(supp_node)
-                    self.edges.append(edge)
-
-                self.clusters.append(
-                    Cluster(
-                        population_center=pop_node,
-                        supporting_nodes=cluster_supporting_nodes,
-                    )
-                )
+            nodes, edges = generate_stratum(
+                self.rng,
+                plane,
+                stratum_num,
+                bounds,
+                num_pop_centers,
+                min_support,
+                max_support,
+                node_id,
+                edge_id,
+                self.instrumentation,
+            )
+            node_id += len(nodes)
+            edge_id += len(edges)
+            stratum_nodes.append(nodes.data)
+            stratum_edges.append(edges.data)
 
-        cluster_connections = []
+        nodes = NodeTable(np.concatenate(stratum_nodes), plane)
 
         # Each cluster is connected to it's closest neighbor
         # node by creating an edge between the two closest
         # supporting nodes (one from each cluster).
-        for cluster in self.clusters:
-            node1, node2, _ = find_closest_nodes(self.clusters, cluster)
-            cluster_connections.append((node1.cluster_id, node2.cluster_id))
-            edge = Edge(
-                edge_id=edge_id,
-                start_node_id=node1.node_id,
-                end_node_id=node2.node_id,
-                plane=self.being_culture.value,
-                length=node_dist(node1, node2),
+        with self.instrumentation.span("cluster_linking"):
+            cluster_index = ClusterIndex(nodes)
+            _, sources, targets, _ = cluster_index.nearest_foreign()
+            links = link_edges(nodes, sources, targets, edge_id)
+            edge_id += len(links)
+            cluster_connections = np.column_stack(
+                [nodes.cluster_id[sources], nodes.cluster_id[targets]]
             )
 
-            edge_id += 1
-
-            self.edges.append(edge)
-
-        # setup a graph to detect disconnected components
-        G = nx.Graph()
-        for cluster_id_1, cluster_id_2 in cluster_connections:
-            G.add_edge(cluster_id_1, cluster_id_2)
-
-        cluster_dict = {c.cluster_id(): c for c in self.clusters}
         # if the clusters form a disconnected graph
-        # keep adding edges until they are connected
-        while not nx.is_connected(G):
-            connected_components = nx.connected_components(G)
-            comp1 = next(connected_components)
-            comp2 = next(connected_components)
-            comp_counter = 2
-
-            cluster_group_1 = [cluster_dict[c] for c in comp1]
-            cluster_group_2 = [cluster_dict[c] for c in comp2]
-
-            node1, node2, min_dist = find_closest_nodes_between_clusters(
-                cluster_group_1, cluster_group_2
-            )
-
-            for comp2 in connected_components:
-                cluster_group_2 = [cluster_dict[c] for c in comp2]
-
-                n1, n2, dist = find_closest_nodes_between_clusters(
-                    cluster_group_1, cluster_group_2
-                )
-
-                if dist < min_dist:
-                    node1 = n1
-                    node2 = n2
-                    min_dist = dist
-
-                comp_counter += 1
-
-            # update the graph
-            G.add_edge(node1.cluster_id, node2.cluster_id)
-
-            # create new edge
-            edge = Edge(
-                edge_id=edge_id,
-                start_node_id=node1.node_id,
-                end_node_id=node2.node_id,
-                plane=self.being_culture.value,
-                length=node_dist(node1, node2),
-            )
-
-            edge_id += 1
-
-            self.edges.append(edge)
-
-            print(f"There are {comp_counter} connected Components")
+        # add the shortest edges which join the components
+        with self.instrumentation.span("connectivity_repair"):
+            sources, targets, _ = cluster_index.connect(cluster_connections)
+            self.bridging_edges = link_edges(nodes, sources, targets, edge_id)
+
+        self.instrumentation.count("knn_queries", cluster_index.num_queries)
+        self.instrumentation.count("knn_query_points", cluster_index.num_query_points)
+        self.instrumentation.count("bridging_edges", len(self.bridging_edges))
+
+        self.nodes = nodes
+        self.edges = EdgeTable(
+            np.concatenate([*stratum_edges, links.data, self.bridging_edges.data]),
+            plane,
+        )
+        logger.info(
+            "generated %d nodes and %d edges, %d edges connect the clusters",
+            len(self.nodes),
+            len(self.edges),
+            len(self.bridging_edges),
+        )
 
     def _draw_circles(self):
         """Draw the domain of the weird science beings"""
@@ -427,17 +761,20 @@ class PlaneMap:
 
     def _setup_plotting(self):
         """Sets up the matplotlib axes"""
+        import matplotlib.pyplot as plt
+
         # plotting setup
         self.fig = plt.figure()
         self.ax = self.fig.add_subplot(111)
         self.ax.set_aspect(1)
         self.title = self.map_file_names[self.being_culture]
-        plt.title(self.title)
+        self.ax.set_title(self.title)
 
         self._draw_circles()
 
 
 def test_main():
+    logging.basicConfig(level=logging.INFO)
     # test generating map and saving
     db_file = generate_sqlite_db_file()
     db_setup(db_file)
@@ -446,14 +783,15 @@ def test_main():
     plane_map.draw()
     plane_map.save_fig()
 
-    print("Drawing Complete.")
-    print(f"saved to {plane_map.title}")
+    logger.info("Drawing Complete.")
+    logger.info("saved to %s", plane_map.title)
+    plane_map.instrumentation.log_summary()
 
     # test the loading
     plane_map = PlaneMap(db_file=db_file, being_culture=plane_map.being_culture)
     plane_map.draw()
     plane_map.save_fig()
-    print("Drawing complete from map loaded from the db")
+    logger.info("Drawing complete from map loaded from the db")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,177 @@
+"""
+shortest paths over the travel graph of a plane
+"""
+from collections import OrderedDict
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from rattle_snake.tables import NodeTable, EdgeTable
+
+
+class Router:
+    """Answers routing queries between the nodes of a plane
+
+    The edges are compiled once into a symmetric CSR adjacency matrix with
+    the edge lengths as weights. Shortest path searches are run with scipy's
+    csgraph for all the requested sources at once, and the distance and
+    predecessor rows of the most recently used sources are kept in an LRU
+    cache. The cache belongs to the tables the router was built from, a
+    router for the new tables is needed when the plane changes.
+    """
+
+    def __init__(self, nodes: NodeTable, edges: EdgeTable, cache_size: int = 256):
+        self.nodes = nodes
+        self.edges = edges
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[int, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        self.graph = self._compile()
+
+    def _compile(self) -> csr_matrix:
+        num_nodes = len(self.nodes)
+        start = self.nodes.indices_of(self.edges.start_node_id)
+        end = self.nodes.indices_of(self.edges.end_node_id)
+        length = self.edges.length
+
+        # keep only the shortest of parallel edges, csr_matrix would add them
+        low = np.minimum(start, end)
+        high = np.maximum(start, end)
+        order = np.lexsort((length, high, low))
+        low, high, length = low[order], high[order], length[order]
+        is_first = np.ones(len(low), dtype=bool)
+        is_first[1:] = (low[1:] != low[:-1]) | (high[1:] != high[:-1])
+        low, high, length = low[is_first], high[is_first], length[is_first]
+
+        return csr_matrix(
+            (
+                np.concatenate([length, length]),
+                (np.concatenate([low, high]), np.concatenate([high, low])),
+            ),
+            shape=(num_nodes, num_nodes),
+        )
+
+    def is_for(self, nodes: NodeTable, edges: EdgeTable) -> bool:
+        """Whether the router was built from these tables"""
+        return self.nodes is nodes and self.edges is edges
+
+    def clear_cache(self) -> None:
+        self._cache.clear()
+
+    def _search(self, sources: np.ndarray) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+        """Distance and predecessor rows of the source indices"""
+        rows = {}
+        missing = []
+        for source in dict.fromkeys(sources.tolist()):
+            if source in self._cache:
+                self._cache.move_to_end(source)
+                rows[source] = self._cache[source]
+            else:
+                missing.append(source)
+
+        if missing:
+            distances, predecessors = dijkstra(
+                self.graph, directed=False, indices=missing, return_predecessors=True
+            )
+            for source, dist_row, pred_row in zip(missing, distances, predecessors):
+                rows[source] = (dist_row, pred_row)
+                self._cache[source] = (dist_row, pred_row)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return rows
+
+    def distances_from(self, source_ids: Sequence[int]) -> np.ndarray:
+        """Distance from each source to every node
+
+        Returns:
+            An array of shape (len(source_ids), len(nodes)) whose columns are
+            in the order of the node table, unreachable nodes are inf.
+        """
+        sources = self.nodes.indices_of(source_ids)
+        rows = self._search(sources)
+        return np.array([rows[source][0] for source in sources.tolist()]).reshape(
+            len(sources), len(self.nodes)
+        )
+
+    def distances(
+        self, source_ids: Sequence[int], target_ids: Sequence[int]
+    ) -> np.ndarray:
+        """Shortest path length of each (source, target) pair"""
+        sources = self.nodes.indices_of(source_ids)
+        targets = self.nodes.indices_of(target_ids)
+        rows = self._search(sources)
+        return np.array(
+            [rows[s][0][t] for s, t in zip(sources.tolist(), targets.tolist())]
+        )
+
+    def shortest_path(self, source_id: int, target_id: int) -> Tuple[List[int], float]:
+        """Node ids along the shortest path from source to target and its length
+
+        The path is empty and the length inf when the target can't be reached.
+        """
+        source = self.nodes.index_of(source_id)
+        target = self.nodes.index_of(target_id)
+        dist_row, pred_row = self._search(np.array([source]))[source]
+        if np.isinf(dist_row[target]):
+            return [], float("inf")
+
+        path = [target]
+        while path[-1] != source:
+            path.append(pred_row[path[-1]])
+        node_ids = self.nodes.node_id[path[::-1]].tolist()
+
+        return node_ids, float(dist_row[target])
+
+    def shortest_paths(
+        self, source_ids: Sequence[int], target_ids: Sequence[int]
+    ) -> List[Tuple[List[int], float]]:
+        """shortest_path of each (source, target) pair, searching all sources at once"""
+        self._search(self.nodes.indices_of(source_ids))
+        return [
+            self.shortest_path(source_id, target_id)
+            for source_id, target_id in zip(source_ids, target_ids)
+        ]
+
+    def route_table(self, node_ids: Sequence[int]) -> Tuple[np.ndarray, np.ndarray]:
+        """All pairs route lengths and next hops between the given nodes
+
+        Returns:
+            The matrix of route lengths and the matrix of the ids of the node
+            following the source on each route. The next hop from a node to
+            itself is the node, and -1 when the target can't be reached.
+        """
+        indices = self.nodes.indices_of(node_ids)
+        rows = self._search(indices)
+        num_nodes = len(self.nodes)
+
+        distances = np.empty((len(indices), len(indices)))
+        next_hops = np.empty((len(indices), len(indices)), dtype=np.int64)
+        for i, source in enumerate(indices.tolist()):
+            dist_row, pred_row = rows[source]
+            # point every node at its predecessor, except for the nodes right
+            # after the source which point at themselves, then follow the
+            # pointers by doubling until every node points at its first hop
+            first_hop = pred_row.copy()
+            stops = (pred_row == source) | (pred_row < 0)
+            first_hop[stops] = np.arange(num_nodes)[stops]
+            while True:
+                jumped = first_hop[first_hop]
+                if np.array_equal(jumped, first_hop):
+                    break
+                first_hop = jumped
+
+            distances[i] = dist_row[indices]
+            next_hops[i] = self.nodes.node_id[first_hop[indices]]
+            next_hops[i, np.isinf(distances[i])] = -1
+
+        return distances, next_hops
+
+    def neighbourhood(self, source_ids: Sequence[int], hops: int) -> List[np.ndarray]:
+        """Ids of the nodes at most hops edges away from each source"""
+        sources = self.nodes.indices_of(source_ids)
+        hop_counts = dijkstra(
+            self.graph, directed=False, indices=sources, unweighted=True, limit=hops
+        ).reshape(len(sources), len(self.nodes))
+        return [self.nodes.node_id[np.isfinite(row)] for row in hop_counts]
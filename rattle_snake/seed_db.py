@@ -1,29 +1,183 @@
 """
 Run this script to seed the database
 """
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import chain
+from typing import List, Optional, Tuple
+
 import click
+import numpy as np
 
-from rattle_snake.db_helpers import generate_sqlite_db_file, db_setup
+from rattle_snake.db_helpers import (
+    generate_sqlite_db_file,
+    db_setup,
+    bulk_write,
+    get_max_ids,
+)
 from rattle_snake.plane_map import PlaneMap
+from rattle_snake.stream_map import stream_plane_to_db
 from rattle_snake.constants import BeingCulture
+from rattle_snake.tables import NodeTable, EdgeTable
+
+
+def generate_plane(
+    being_culture: BeingCulture, seed_sequence: np.random.SeedSequence, **kwargs
+) -> Tuple[NodeTable, EdgeTable]:
+    """Generate the nodes and edges of one plane
+
+    Runs in a worker process, the random generator is seeded from the plane's
+    own seed sequence so that every plane gets an independent stream. The
+    generation parameters in kwargs are passed to PlaneMap.
+    """
+    plane_map = PlaneMap(
+        being_culture=being_culture,
+        rng=np.random.default_rng(seed_sequence),
+        **kwargs,
+    )
+    return plane_map.nodes, plane_map.edges
+
+
+def allocate_ids(
+    planes: List[Tuple[NodeTable, EdgeTable]],
+    first_node_id: int = 1,
+    first_edge_id: int = 1,
+) -> List[Tuple[NodeTable, EdgeTable]]:
+    """Shift the ids of each plane into its own range
+
+    Every plane is generated with ids starting at 1, the planes are given
+    consecutive ranges starting at first_node_id and first_edge_id.
+    """
+    allocated = []
+    node_offset = first_node_id - 1
+    edge_offset = first_edge_id - 1
+    for nodes, edges in planes:
+        allocated.append(
+            (
+                nodes.with_id_offset(node_offset),
+                edges.with_id_offset(edge_offset, node_offset),
+            )
+        )
+        node_offset += int(nodes.node_id.max(initial=0))
+        edge_offset += int(edges.edge_id.max(initial=0))
+
+    return allocated
+
+
+def seed_nodes_and_edges(
+    db_file: str,
+    seed: Optional[int] = None,
+    parallel: bool = True,
+    max_workers: Optional[int] = None,
+    **kwargs,
+):
+    """Creates entries in the database for all nodes and edges for each of the three planes
 
+    The planes are generated in a process pool and written by this process in
+    a single transaction. The ids continue from the largest ids already in
+    the database so that the planes never collide.
 
-def seed_nodes_and_edges(db_file: str):
-    """Creates entries in the database for all nodes and edges for each of the three planes"""
-    plane_map = PlaneMap(being_culture=BeingCulture.WEIRD)
-    plane_map.save_to_db(db_file=db_file)
-    plane_map = PlaneMap(being_culture=BeingCulture.DEEP)
-    plane_map.save_to_db(db_file=db_file)
-    plane_map = PlaneMap(being_culture=BeingCulture.DREAM)
-    plane_map.save_to_db(db_file=db_file)
+    Args:
+        db_file (str): Path to a db_file which has been setup
+        seed (int): Seed of the random streams, new entropy when None
+        parallel (bool): Whether to generate the planes in separate processes
+        max_workers (int): Size of the process pool, defaults to the cpu count
+        kwargs: Generation parameters passed to PlaneMap
+    """
+    being_cultures = [BeingCulture.WEIRD, BeingCulture.DEEP, BeingCulture.DREAM]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(being_cultures))
+    generate = partial(generate_plane, **kwargs)
 
+    if parallel:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            planes = list(executor.map(generate, being_cultures, seed_sequences))
+    else:
+        planes = list(map(generate, being_cultures, seed_sequences))
 
-def seed_db(db_file: str = "hello.db"):
-    """This seeds the database file"""
+    max_node_id, max_edge_id = get_max_ids(db_file)
+    planes = allocate_ids(
+        planes, first_node_id=max_node_id + 1, first_edge_id=max_edge_id + 1
+    )
+
+    bulk_write(
+        db_file,
+        chain.from_iterable(nodes.to_db_rows() for nodes, _ in planes),
+        chain.from_iterable(edges.to_db_rows() for _, edges in planes),
+    )
+
+
+def stream_nodes_and_edges(db_file: str, seed: Optional[int] = None, **kwargs):
+    """Stream each of the three planes into the database one after the other
+
+    Every plane is written stratum by stratum, so planes far larger than
+    memory can be seeded. The planes get the same seed sequences as in
+    seed_nodes_and_edges.
+
+    Args:
+        db_file (str): Path to a db_file which has been setup
+        seed (int): Seed of the random streams, new entropy when None
+        kwargs: Generation parameters passed to StreamingPlaneGenerator
+    """
+    being_cultures = [BeingCulture.WEIRD, BeingCulture.DEEP, BeingCulture.DREAM]
+    seed_sequences = np.random.SeedSequence(seed).spawn(len(being_cultures))
+    for being_culture, seed_sequence in zip(being_cultures, seed_sequences):
+        stream_plane_to_db(
+            db_file,
+            being_culture=being_culture,
+            rng=np.random.default_rng(seed_sequence),
+            **kwargs,
+        )
+
+
+def seed_db(
+    db_file: str = "hello.db",
+    seed: Optional[int] = None,
+    parallel: bool = True,
+    max_workers: Optional[int] = None,
+    stream: bool = False,
+    **kwargs,
+):
+    """This seeds the database file
+
+    The planes are generated with the generation parameters in kwargs. With
+    stream they are generated stratum by stratum instead of in a process pool.
+    """
     db_setup(db_file=db_file)
     click.echo(f"setup db_file {db_file}")
-    seed_nodes_and_edges(db_file)
+    if stream:
+        stream_nodes_and_edges(db_file, seed=seed, **kwargs)
+    else:
+        seed_nodes_and_edges(
+            db_file, seed=seed, parallel=parallel, max_workers=max_workers, **kwargs
+        )
+
+
+@click.command()
+@click.option("--db-file", default="hello.db", help="Database file to seed")
+@click.option("--seed", type=int, default=None, help="Seed for reproducible planes")
+@click.option(
+    "--parallel/--sequential", default=True, help="Generate planes in processes"
+)
+@click.option("--max-workers", type=int, default=None, help="Size of process pool")
+@click.option("--stream", is_flag=True, help="Write each stratum as it is generated")
+@click.option("--num-circles", default=4, help="Strata per plane")
+@click.option("--center-k", default=3, help="Clusters in the central stratum")
+@click.option("--k", default=7, help="Clusters in the other strata")
+def main(db_file, seed, parallel, max_workers, stream, num_circles, center_k, k):
+    logging.basicConfig(level=logging.INFO)
+    seed_db(
+        db_file=db_file,
+        seed=seed,
+        parallel=parallel,
+        max_workers=max_workers,
+        stream=stream,
+        num_circles=num_circles,
+        center_k=center_k,
+        k=k,
+    )
 
 
 if __name__ == "__main__":
-    seed_db()
+    main()
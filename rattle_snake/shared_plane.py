@@ -0,0 +1,204 @@
+"""
+share the node and edge tables of planes between processes
+
+One process publishes each plane's arrays into shared memory segments with
+a SharedPlaneStore and hands the SharedPlaneHandle to the workers, which
+attach to the segments read only with SharedPlane. Every worker maps the
+same pages, so adding workers doesn't add copies of the planes.
+
+    with SharedPlaneStore() as store:
+        handle = store.publish_from_db(db_file, "weird_science")
+        executor.map(simulate, [handle] * num_workers)
+
+    def simulate(handle):
+        with SharedPlane(handle) as shared:
+            plane_map = PlaneMap(shared=shared, being_culture=BeingCulture.WEIRD)
+"""
+import ctypes
+import logging
+import sys
+import threading
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import List
+
+import numpy as np
+
+from rattle_snake.db_helpers import get_num_circles, load_plane_nodes, load_plane_edges
+from rattle_snake.tables import NodeTable, EdgeTable
+
+
+logger = logging.getLogger(__name__)
+
+# SharedMemory only takes track from python 3.13
+CAN_ATTACH_UNTRACKED = sys.version_info >= (3, 13)
+
+# held while resource_tracker.register is swapped out
+_register_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class SharedPlaneHandle:
+    """Everything a worker needs to attach to a published plane, cheap to pickle"""
+
+    plane: str
+    num_circles: int
+    nodes_segment: str
+    edges_segment: str
+    num_nodes: int
+    num_edges: int
+
+
+def _create_segment(data: np.ndarray) -> SharedMemory:
+    # segments can't be empty
+    segment = SharedMemory(create=True, size=max(data.nbytes, 1))
+    shared = np.ndarray(data.shape, dtype=data.dtype, buffer=segment.buf)
+    shared[:] = data
+    del shared
+    return segment
+
+
+class _AttachedSegment(SharedMemory):
+    """Segment attached by a worker
+
+    The worker attaches without registering the segment with the resource
+    tracker, which would unlink it when the worker exits and pull the plane
+    away from the publisher and every other worker. Registering and then
+    unregistering isn't enough, forked workers share the publisher's
+    tracker and the unregister would drop the publisher's registration.
+    The segment stays mapped while arrays still use it.
+    """
+
+    def __init__(self, name: str):
+        if CAN_ATTACH_UNTRACKED:
+            super().__init__(name=name, track=False)
+            return
+
+        with _register_lock:
+            register = resource_tracker.register
+            resource_tracker.register = lambda name, rtype: None
+            try:
+                super().__init__(name=name)
+            finally:
+                resource_tracker.register = register
+
+    def close(self) -> None:
+        try:
+            super().close()
+        except BufferError:
+            # a PlaneMap or a column still refers to the segment, it is
+            # unmapped when the last of them is gone
+            logger.debug("segment %s is still in use", self.name)
+
+
+class SharedPlaneStore:
+    """Owns the shared memory segments of the published planes
+
+    The segments are unlinked by close, which should only be called once
+    the workers are done with them. The segments are registered with the
+    publisher's resource tracker, which unlinks the ones left behind by a
+    publisher that died once the publisher and its workers have exited.
+    """
+
+    def __init__(self):
+        self.segments: List[SharedMemory] = []
+
+    def publish(
+        self, nodes: NodeTable, edges: EdgeTable, num_circles: int
+    ) -> SharedPlaneHandle:
+        """Copy the tables into new segments"""
+        nodes_segment = _create_segment(nodes.data)
+        self.segments.append(nodes_segment)
+        edges_segment = _create_segment(edges.data)
+        self.segments.append(edges_segment)
+        logger.info(
+            "published %d nodes and %d edges of %s to shared memory",
+            len(nodes),
+            len(edges),
+            nodes.plane,
+        )
+
+        return SharedPlaneHandle(
+            plane=nodes.plane,
+            num_circles=num_circles,
+            nodes_segment=nodes_segment.name,
+            edges_segment=edges_segment.name,
+            num_nodes=len(nodes),
+            num_edges=len(edges),
+        )
+
+    def publish_from_db(self, db_file: str, plane: str) -> SharedPlaneHandle:
+        """Load a plane from the database once and publish it"""
+        return self.publish(
+            NodeTable(load_plane_nodes(db_file, plane), plane),
+            EdgeTable(load_plane_edges(db_file, plane), plane),
+            get_num_circles(db_file, plane),
+        )
+
+    def close(self) -> None:
+        """Release and unlink every segment"""
+        for segment in self.segments:
+            segment.close()
+            try:
+                segment.unlink()
+            except FileNotFoundError:
+                pass
+        self.segments = []
+
+    def __enter__(self) -> "SharedPlaneStore":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class SharedPlane:
+    """Read only view of a published plane inside a worker
+
+    close drops the tables and releases the segments, a segment stays
+    mapped as long as a table or column taken from it is still in use.
+    """
+
+    def __init__(self, handle: SharedPlaneHandle):
+        self.handle = handle
+        self.plane = handle.plane
+        self.num_circles = handle.num_circles
+        self._segments = []
+        try:
+            self.nodes = NodeTable(
+                self._attach(handle.nodes_segment, NodeTable.dtype, handle.num_nodes),
+                handle.plane,
+            )
+            self.edges = EdgeTable(
+                self._attach(handle.edges_segment, EdgeTable.dtype, handle.num_edges),
+                handle.plane,
+            )
+        except BaseException:
+            self.close()
+            raise
+
+    def _attach(self, name: str, dtype: np.dtype, size: int) -> np.ndarray:
+        segment = _AttachedSegment(name)
+        self._segments.append(segment)
+        # numpy doesn't hold on to the buffer it is given, so the segment
+        # could be unmapped under the array. A ctypes view does hold it and
+        # keeps the segment mapped for as long as the array is alive.
+        view = (ctypes.c_char * len(segment.buf)).from_buffer(segment.buf)
+        data = np.frombuffer(view, dtype=dtype, count=size)
+        data.flags.writeable = False
+        return data
+
+    def close(self) -> None:
+        """Release the segments once nothing else uses the tables"""
+        self.nodes = None
+        self.edges = None
+        for segment in self._segments:
+            segment.close()
+        self._segments = []
+
+    def __enter__(self) -> "SharedPlane":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
@@ -0,0 +1,280 @@
+"""
+generate a plane stratum by stratum, writing each one to the database as it is made
+"""
+
+import logging
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+import numpy as np
+
+from rattle_snake.cluster import ClusterIndex, DisjointSet
+from rattle_snake.constants import BeingCulture
+from rattle_snake.db_helpers import (
+    BULK_BATCH_SIZE,
+    BulkWriteStats,
+    bulk_write,
+    delete_plane_rows_from,
+    get_max_ids,
+)
+from rattle_snake.instrument import Instrumentation
+from rattle_snake.plane_map import generate_stratum, link_edges, stratum_boundaries
+from rattle_snake.tables import NodeTable, EdgeTable
+
+logger = logging.getLogger(__name__)
+
+
+class StreamingPlaneGenerator:
+    """Generates a plane without holding all of it in memory
+
+    The strata are generated from the center out with the same random
+    stream as PlaneMap, so the nodes and the edges inside the clusters are
+    the ones PlaneMap would generate from the same seed. Only a window of
+    three consecutive strata is kept. Once a stratum and both of its
+    neighbours are in the window its clusters are linked to their closest
+    foreign node among the three, and after that the window moves on. The
+    nodes of each stratum are written as soon as they are generated and the
+    links as soon as they are found.
+
+    The only state kept for the whole plane is a disjoint set over the
+    cluster ids. A component which has no cluster left in the window can
+    never be linked again, so it is bridged to the closest foreign node in
+    the window before its last clusters leave. This keeps the plane
+    connected but the bridges are chosen within the window, so they can
+    differ from the ones PlaneMap chooses, as can a link whose closest
+    foreign node is more than one stratum away.
+    """
+
+    def __init__(
+        self,
+        db_file: str,
+        being_culture: BeingCulture = BeingCulture.WEIRD,
+        num_circles: int = 4,
+        center_k: int = 3,
+        k: int = 7,
+        min_support: int = 3,
+        max_support: int = 10,
+        seed: Optional[int] = None,
+        rng: Optional[np.random.Generator] = None,
+        instrumentation: Optional[Instrumentation] = None,
+        journal_mode: str = "WAL",
+        synchronous: str = "NORMAL",
+        batch_size: int = BULK_BATCH_SIZE,
+        first_node_id: Optional[int] = None,
+        first_edge_id: Optional[int] = None,
+    ):
+        """Sets up the generator, see PlaneMap for the generation parameters
+
+        Args:
+            db_file (str): Path to a db_file which has been setup
+            first_node_id (int): Id of the first node, continues from the
+                largest node id in the database when None
+            first_edge_id (int): Id of the first edge, continues from the
+                largest edge id in the database when None
+        """
+        self.db_file = db_file
+        self.plane = being_culture.value
+        self.num_circles = num_circles
+        self.center_k = center_k
+        self.k = k
+        self.min_support = min_support
+        self.max_support = max_support
+        self.rng = rng if rng is not None else np.random.default_rng(seed)
+        self.instrumentation = instrumentation or Instrumentation()
+        self.journal_mode = journal_mode
+        self.synchronous = synchronous
+        self.batch_size = batch_size
+
+        max_node_id, max_edge_id = get_max_ids(db_file)
+        self.node_id = max_node_id + 1 if first_node_id is None else first_node_id
+        self.edge_id = max_edge_id + 1 if first_edge_id is None else first_edge_id
+
+        # the nodes of the strata in the window, oldest first
+        self.window: Deque[Tuple[int, NodeTable]] = deque()
+        # disjoint set over every cluster generated so far
+        self.components = DisjointSet(0)
+        self.cluster_items: Dict[int, int] = {}
+        self.num_nodes = 0
+        self.num_edges = 0
+        self.write_seconds = 0.0
+
+    def generate(self) -> BulkWriteStats:
+        """Generate and write the whole plane
+
+        Every stratum is committed on its own, so when the generation fails
+        the rows written for the plane so far are deleted again before the
+        exception is raised.
+
+        Returns:
+            The number of rows written and the time spent writing them
+        """
+        first_node_id = self.node_id
+        first_edge_id = self.edge_id
+        try:
+            self._generate()
+        except Exception:
+            num_nodes, num_edges = delete_plane_rows_from(
+                self.db_file, self.plane, first_node_id, first_edge_id
+            )
+            logger.warning(
+                "deleted the %d nodes and %d edges of %s written before the failure",
+                num_nodes,
+                num_edges,
+                self.plane,
+            )
+            raise
+
+        stats = BulkWriteStats(
+            num_nodes=self.num_nodes,
+            num_edges=self.num_edges,
+            seconds=self.write_seconds,
+        )
+        logger.info(
+            "streamed %d nodes and %d edges of %s to %s",
+            stats.num_nodes,
+            stats.num_edges,
+            self.plane,
+            self.db_file,
+        )
+        return stats
+
+    def _generate(self) -> None:
+        """Generate and write the strata from the center out"""
+        for stratum_num, bounds in enumerate(stratum_boundaries(self.num_circles), 1):
+            num_pop_centers = self.center_k if stratum_num == 1 else self.k
+            nodes, edges = generate_stratum(
+                self.rng,
+                self.plane,
+                stratum_num,
+                bounds,
+                num_pop_centers,
+                self.min_support,
+                self.max_support,
+                self.node_id,
+                self.edge_id,
+                self.instrumentation,
+            )
+            self.node_id += len(nodes)
+            self.edge_id += len(edges)
+            for cluster_id in nodes.cluster_id[nodes.is_population_center].tolist():
+                self.cluster_items[cluster_id] = self.components.add()
+
+            self.window.append((stratum_num, nodes))
+            if len(self.window) > 3:
+                self.window.popleft()
+
+            # the previous stratum now has both of its neighbours
+            self._write(nodes, edges.concat(self._finish_stratum(stratum_num - 1)))
+            logger.debug(
+                "stratum %d: %d nodes, %d clusters in the window",
+                stratum_num,
+                len(nodes),
+                sum(nodes.is_population_center.sum() for _, nodes in self.window),
+            )
+
+        # the outermost stratum has no neighbour beyond it
+        self._write(
+            NodeTable.empty(0, self.plane),
+            self._finish_stratum(self.num_circles, last=True),
+        )
+
+    def _finish_stratum(self, stratum_num: int, last: bool = False) -> EdgeTable:
+        """Link the clusters of the stratum and bridge the components leaving the window
+
+        Args:
+            stratum_num (int): Stratum whose neighbours are in the window
+            last (bool): Whether no more strata follow, then every component
+                is bridged until the plane is connected
+        """
+        nodes = NodeTable(
+            np.concatenate([nodes.data for _, nodes in self.window]), self.plane
+        )
+        cluster_strata = nodes.stratum_id[nodes.is_population_center]
+        if stratum_num < 1 or len(cluster_strata) < 2:
+            return EdgeTable.empty(0, self.plane)
+
+        cluster_index = ClusterIndex(nodes)
+        items = [
+            self.cluster_items[cluster_id]
+            for cluster_id in cluster_index.cluster_ids.tolist()
+        ]
+        # the nodes at both ends of the new edges
+        edge_sources = []
+        edge_targets = []
+
+        with self.instrumentation.span("cluster_linking"):
+            labels, sources, targets, _ = cluster_index.nearest_foreign()
+            for label, source, target in zip(labels, sources, targets):
+                if cluster_strata[label] != stratum_num:
+                    continue
+                edge_sources.append(source)
+                edge_targets.append(target)
+                self.components.union(
+                    items[cluster_index.labels[source]],
+                    items[cluster_index.labels[target]],
+                )
+
+        with self.instrumentation.span("connectivity_repair"):
+            while True:
+                roots = np.array([self.components.find(item) for item in items])
+                if last:
+                    closed = np.unique(roots) if len(np.unique(roots)) > 1 else []
+                else:
+                    # components without a cluster in this stratum or the
+                    # next one will not be linked by any later stratum
+                    staying = np.unique(roots[cluster_strata >= stratum_num])
+                    closed = np.setdiff1d(roots, staying)
+                if len(closed) == 0:
+                    break
+
+                _, groups = np.unique(roots, return_inverse=True)
+                closed_groups = set(groups[np.isin(roots, closed)].tolist())
+                labels, sources, targets, distances = cluster_index.nearest_foreign(
+                    groups
+                )
+                num_components = self.components.num_components
+                for i in np.argsort(distances, kind="stable"):
+                    if labels[i] not in closed_groups:
+                        continue
+                    if self.components.union(
+                        items[cluster_index.labels[sources[i]]],
+                        items[cluster_index.labels[targets[i]]],
+                    ):
+                        edge_sources.append(sources[i])
+                        edge_targets.append(targets[i])
+                        self.instrumentation.count("bridging_edges")
+
+                if self.components.num_components == num_components:
+                    raise ValueError("The clusters can not be connected")
+
+        self.instrumentation.count("knn_queries", cluster_index.num_queries)
+        self.instrumentation.count("knn_query_points", cluster_index.num_query_points)
+        edges = link_edges(
+            nodes,
+            np.array(edge_sources, dtype=np.intp),
+            np.array(edge_targets, dtype=np.intp),
+            self.edge_id,
+        )
+        self.edge_id += len(edges)
+        return edges
+
+    def _write(self, nodes: NodeTable, edges: EdgeTable) -> None:
+        with self.instrumentation.span("db_write"):
+            stats = bulk_write(
+                self.db_file,
+                nodes.to_db_rows(),
+                edges.to_db_rows(),
+                journal_mode=self.journal_mode,
+                synchronous=self.synchronous,
+                batch_size=self.batch_size,
+            )
+        self.num_nodes += stats.num_nodes
+        self.num_edges += stats.num_edges
+        self.write_seconds += stats.seconds
+        self.instrumentation.count("rows_written", stats.num_nodes + stats.num_edges)
+
+
+def stream_plane_to_db(db_file: str, **kwargs) -> BulkWriteStats:
+    """Generate a plane straight into db_file, see StreamingPlaneGenerator"""
+    return StreamingPlaneGenerator(db_file, **kwargs).generate()
@@ -0,0 +1,224 @@
+"""
+columnar storage of the nodes and edges of a plane
+"""
+from typing import Iterable, Iterator, Tuple, Union
+
+import numpy as np
+
+from rattle_snake.node import Node, tuple_to_node
+from rattle_snake.edge import Edge, tuple_to_edge
+
+
+NODE_DTYPE = np.dtype(
+    [
+        ("node_id", np.int64),
+        ("x", np.float64),
+        ("y", np.float64),
+        ("stratum_id", np.int32),
+        ("cluster_id", np.int64),
+        ("is_population_center", np.bool_),
+        ("resource_yeild", np.int32),
+    ]
+)
+
+EDGE_DTYPE = np.dtype(
+    [
+        ("edge_id", np.int64),
+        ("start_node_id", np.int64),
+        ("end_node_id", np.int64),
+        ("length", np.float64),
+    ]
+)
+
+
+class Table:
+    """Rows of one plane stored in a NumPy structured array
+
+    Every column is available as a zero copy view, e.g. ``table.x``, and
+    the table behaves like a read only list of records which are only
+    built when they are accessed.
+    """
+
+    dtype: np.dtype
+    id_column: str
+
+    def __init__(self, data: np.ndarray, plane: str):
+        if data.dtype != self.dtype:
+            raise ValueError(
+                f"Expected an array of dtype {self.dtype}, got {data.dtype}"
+            )
+        self.data = data
+        self.plane = plane
+        self._id_offset = None
+        self._sorted_ids = None
+        self._id_order = None
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        # only called when normal lookup fails, which is where columns live
+        if name != "data" and name in self.dtype.names:
+            return self.data[name]
+        raise AttributeError(f"{type(self).__name__} has no attribute {name}")
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return type(self)(self.data[index], self.plane)
+        return self._to_record(self.data[index])
+
+    def __iter__(self) -> Iterator:
+        for row in self.data.tolist():
+            yield self._row_to_record(row)
+
+    def __getstate__(self):
+        # the id index is rebuilt on demand
+        return {"data": self.data, "plane": self.plane}
+
+    def __setstate__(self, state):
+        self.__init__(state["data"], state["plane"])
+
+    @classmethod
+    def empty(cls, size: int, plane: str):
+        """Allocate a table of size rows to be filled in"""
+        return cls(np.zeros(size, dtype=cls.dtype), plane)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple], plane: str):
+        """Build a table from tuples in the column order of dtype"""
+        return cls(np.array(list(rows), dtype=cls.dtype), plane)
+
+    def concat(self, other):
+        """A new table with the rows of other after the rows of this table"""
+        return type(self)(np.concatenate([self.data, other.data]), self.plane)
+
+    def _to_record(self, row: np.void):
+        return self._row_to_record(row.tolist())
+
+    def _row_to_record(self, row: Tuple):
+        raise NotImplementedError
+
+    def _build_id_index(self) -> None:
+        ids = self.data[self.id_column]
+        if len(ids) and ids[-1] - ids[0] == len(ids) - 1 and np.all(np.diff(ids) == 1):
+            # ids are generated as a consecutive range
+            self._id_offset = int(ids[0])
+        else:
+            self._id_order = np.argsort(ids, kind="stable")
+            self._sorted_ids = ids[self._id_order]
+
+    def indices_of(self, ids) -> np.ndarray:
+        """Row positions of the given ids
+
+        This is a subtraction when the ids are a consecutive range, as they
+        are for generated planes, otherwise a binary search.
+        """
+        if self._id_offset is None and self._sorted_ids is None:
+            self._build_id_index()
+
+        ids = np.asarray(ids, dtype=np.int64)
+        if self._id_offset is not None:
+            indices = ids - self._id_offset
+            found = (indices >= 0) & (indices < len(self))
+        else:
+            positions = np.searchsorted(self._sorted_ids, ids)
+            positions = np.minimum(positions, max(len(self) - 1, 0))
+            found = (
+                self._sorted_ids[positions] == ids
+                if len(self)
+                else np.zeros(ids.shape, dtype=bool)
+            )
+            indices = self._id_order[positions] if len(self) else positions
+
+        if not np.all(found):
+            missing = ids[~found]
+            raise KeyError(f"{self.id_column} not found: {missing[:10].tolist()}")
+
+        return indices
+
+    def index_of(self, row_id: int) -> int:
+        """Row position of the given id"""
+        return int(self.indices_of([row_id])[0])
+
+
+class NodeTable(Table):
+    """Columns node_id, x, y, stratum_id, cluster_id, is_population_center, resource_yeild"""
+
+    dtype = NODE_DTYPE
+    id_column = "node_id"
+
+    @classmethod
+    def from_nodes(cls, nodes: Iterable[Node], plane: str) -> "NodeTable":
+        return cls.from_rows(
+            (
+                (
+                    node.node_id,
+                    node.x,
+                    node.y,
+                    node.stratum_id,
+                    node.cluster_id,
+                    node.is_population_center,
+                    node.resource_yeild,
+                )
+                for node in nodes
+            ),
+            plane,
+        )
+
+    def _row_to_record(self, row: Tuple) -> Node:
+        node_id, x, y, *rest = row
+        return tuple_to_node(node_id, x, y, self.plane, *rest)
+
+    def with_id_offset(self, node_offset: int) -> "NodeTable":
+        """A copy with node_offset added to the node and cluster ids"""
+        data = self.data.copy()
+        data["node_id"] += node_offset
+        data["cluster_id"] += node_offset
+        return NodeTable(data, self.plane)
+
+    def node(self, node_id: int) -> Node:
+        """Build the Node with the given id"""
+        return self[self.index_of(node_id)]
+
+    def to_db_rows(self) -> Iterator[Tuple]:
+        """Rows in the column order of the nodes table"""
+        for node_id, x, y, *rest in self.data.tolist():
+            yield (node_id, x, y, self.plane, *rest)
+
+
+class EdgeTable(Table):
+    """Columns edge_id, start_node_id, end_node_id, length"""
+
+    dtype = EDGE_DTYPE
+    id_column = "edge_id"
+
+    @classmethod
+    def from_edges(cls, edges: Iterable[Edge], plane: str) -> "EdgeTable":
+        return cls.from_rows(
+            (
+                (edge.edge_id, edge.start_node_id, edge.end_node_id, edge.length)
+                for edge in edges
+            ),
+            plane,
+        )
+
+    def _row_to_record(self, row: Tuple) -> Edge:
+        edge_id, start_node_id, end_node_id, length = row
+        return tuple_to_edge(edge_id, start_node_id, end_node_id, self.plane, length)
+
+    def with_id_offset(self, edge_offset: int, node_offset: int) -> "EdgeTable":
+        """A copy with the offsets added to the edge ids and node ids"""
+        data = self.data.copy()
+        data["edge_id"] += edge_offset
+        data["start_node_id"] += node_offset
+        data["end_node_id"] += node_offset
+        return EdgeTable(data, self.plane)
+
+    def edge(self, edge_id: int) -> Edge:
+        """Build the Edge with the given id"""
+        return self[self.index_of(edge_id)]
+
+    def to_db_rows(self) -> Iterator[Tuple]:
+        """Rows in the column order of the edges table"""
+        for edge_id, start_node_id, end_node_id, length in self.data.tolist():
+            yield (edge_id, start_node_id, end_node_id, self.plane, length)
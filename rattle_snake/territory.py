@@ -0,0 +1,93 @@
+"""
+ownership of the points of a plane by its clusters
+"""
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from rattle_snake.tables import NodeTable
+
+
+@dataclass
+class Territories:
+    """Owner of each looked up point, arrays in the order of the points
+
+    Points outside of the plane have cluster_id -1, stratum_id 0 and an
+    infinite distance.
+    """
+
+    cluster_id: np.ndarray
+    stratum_id: np.ndarray
+    distance: np.ndarray
+
+
+class TerritoryIndex:
+    """Answers which cluster owns a point of the plane
+
+    A point belongs to the cluster of the node closest to it, so the
+    territory of a cluster is the union of the Voronoi cells of its nodes.
+    Its population center is the node with the cluster's id and its
+    stratum is the stratum of the cluster. The nodes are put in a KD-tree
+    once and the points are looked up in chunks with every core.
+    """
+
+    # points per KD-tree query, bounds the memory of a lookup
+    chunk_size = 2**20
+
+    def __init__(self, nodes: NodeTable, outer_radius: Optional[float] = None):
+        """
+        Args:
+            nodes (NodeTable): Nodes of the plane
+            outer_radius (float): Radius of the plane, points further from
+                the center aren't owned by any cluster. Every point is owned
+                when None.
+        """
+        if not len(nodes):
+            raise ValueError("A territory index needs at least one node")
+        self.nodes = nodes
+        self.outer_radius = outer_radius
+        self.tree = cKDTree(np.column_stack([nodes.x, nodes.y]))
+        self.cluster_ids = np.asarray(nodes.cluster_id)
+        self.stratum_ids = np.asarray(nodes.stratum_id)
+
+    def is_for(self, nodes: NodeTable, outer_radius: Optional[float] = None) -> bool:
+        """Whether the index was built from these nodes"""
+        return self.nodes is nodes and self.outer_radius == outer_radius
+
+    def lookup(self, x, y) -> Territories:
+        """Owner of every point (x[i], y[i])
+
+        Returns:
+            The cluster id and stratum id of the owner of each point and the
+            distance to the closest node of the owner.
+        """
+        x = np.asarray(x, dtype=np.float64).ravel()
+        y = np.asarray(y, dtype=np.float64).ravel()
+        if x.shape != y.shape:
+            raise ValueError(f"x and y differ in length, {len(x)} != {len(y)}")
+
+        distance = np.empty(len(x))
+        nearest = np.empty(len(x), dtype=np.intp)
+        for start in range(0, len(x), self.chunk_size):
+            end = start + self.chunk_size
+            distance[start:end], nearest[start:end] = self.tree.query(
+                np.column_stack([x[start:end], y[start:end]]), workers=-1
+            )
+
+        cluster_id = self.cluster_ids[nearest]
+        stratum_id = self.stratum_ids[nearest]
+        if self.outer_radius is not None:
+            outside = np.hypot(x, y) > self.outer_radius
+            cluster_id[outside] = -1
+            stratum_id[outside] = 0
+            distance[outside] = np.inf
+
+        return Territories(
+            cluster_id=cluster_id, stratum_id=stratum_id, distance=distance
+        )
+
+    def owner(self, x: float, y: float) -> int:
+        """Cluster id of the owner of a single point, -1 outside of the plane"""
+        return int(self.lookup([x], [y]).cluster_id[0])
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from rattle_snake.cluster import ClusterIndex
+from rattle_snake.constants import BeingCulture
+from rattle_snake.plane_map import PlaneMap
+
+
+def seeded_plane_maps():
+    for seed in range(8):
+        for being_culture in BeingCulture:
+            yield PlaneMap(
+                being_culture=being_culture,
+                num_circles=3 + seed % 3,
+                seed=seed,
+            )
+
+
+PLANE_MAPS = list(seeded_plane_maps())
+
+
+def brute_force_nearest_foreign(cluster_index, groups, source_clusters):
+    """Closest pair leaving each group, by comparing every pair of nodes"""
+    node_groups = groups[cluster_index.labels]
+    support = cluster_index.support_index
+    is_source = np.isin(cluster_index.labels, source_clusters)
+    closest = {}
+    for group in np.unique(node_groups[is_source]):
+        sources = np.flatnonzero(is_source & (node_groups == group))
+        targets = support[node_groups[support] != group]
+        if not len(targets):
+            continue
+        diff = cluster_index.xy[sources, None] - cluster_index.xy[None, targets]
+        dist = np.hypot(diff[..., 0], diff[..., 1])
+        source, target = np.unravel_index(dist.argmin(), dist.shape)
+        closest[group] = (sources[source], targets[target], dist[source, target])
+
+    return closest
+
+
+@pytest.mark.parametrize("plane_map", PLANE_MAPS)
+def test_closest_pair_of_every_cluster_matches_brute_force(plane_map):
+    cluster_index = ClusterIndex(plane_map.nodes)
+    clusters = np.arange(len(cluster_index.cluster_ids))
+    expected = brute_force_nearest_foreign(cluster_index, clusters, clusters)
+
+    labels, sources, targets, distances = cluster_index.nearest_foreign()
+
+    assert labels.tolist() == clusters.tolist()
+    for label, source, target, distance in zip(labels, sources, targets, distances):
+        expected_source, expected_target, expected_distance = expected[label]
+        assert source == expected_source
+        assert target == expected_target
+        assert distance == pytest.approx(expected_distance)
+
+
+@pytest.mark.parametrize("plane_map", PLANE_MAPS)
+def test_nearest_foreign_matches_brute_force(plane_map):
+    rng = np.random.default_rng(len(plane_map.nodes))
+    cluster_index = ClusterIndex(plane_map.nodes)
+    num_clusters = len(cluster_index.cluster_ids)
+    # a few large groups send most searches past the first passes
+    for num_groups in (2, 3, num_clusters // 2, num_clusters):
+        groups = rng.integers(0, num_groups, num_clusters)
+        source_clusters = np.flatnonzero(rng.random(num_clusters) < 0.7)
+        expected = brute_force_nearest_foreign(cluster_index, groups, source_clusters)
+
+        labels, sources, targets, distances = cluster_index.nearest_foreign(
+            groups, source_clusters
+        )
+
+        assert sorted(labels.tolist()) == sorted(expected)
+        for label, source, target, distance in zip(labels, sources, targets, distances):
+            expected_source, expected_target, expected_distance = expected[label]
+            assert source == expected_source
+            assert target == expected_target
+            assert distance == pytest.approx(expected_distance)
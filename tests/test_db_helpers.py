@@ -0,0 +1,69 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+from rattle_snake.constants import BeingCulture
+from rattle_snake.db_helpers import (
+    CREATE_EDGES_TABLE_QUERY,
+    CREATE_NODES_TABLE_QUERY,
+    INSERT_EDGE_QUERY,
+    INSERT_NODE_QUERY,
+    SCHEMA_MIGRATIONS,
+    configure_bulk_write,
+    db_setup,
+    get_cluster_resources,
+    get_schema_version,
+)
+from rattle_snake.plane_map import PlaneMap
+
+
+def write_baseline_db(db_file: str, plane_map: PlaneMap) -> None:
+    """Write the map the way save_to_db did before the schema was versioned
+
+    The baseline stored every node's node_id in its cluster_id.
+    """
+    conn = sqlite3.connect(db_file)
+    conn.execute(CREATE_NODES_TABLE_QUERY)
+    conn.execute(CREATE_EDGES_TABLE_QUERY)
+    for node_id, x, y, plane, stratum_id, _, *rest in plane_map.nodes.to_db_rows():
+        conn.execute(
+            INSERT_NODE_QUERY, (node_id, x, y, plane, stratum_id, node_id, *rest)
+        )
+    conn.executemany(INSERT_EDGE_QUERY, plane_map.edges.to_db_rows())
+    conn.commit()
+    conn.close()
+
+
+def test_db_setup_fixes_baseline_cluster_ids(tmp_path):
+    db_file = str(tmp_path / "baseline.db")
+    plane_map = PlaneMap(being_culture=BeingCulture.WEIRD, num_circles=3, seed=0)
+    write_baseline_db(db_file, plane_map)
+
+    db_setup(db_file)
+
+    conn = sqlite3.connect(db_file)
+    assert get_schema_version(conn) == len(SCHEMA_MIGRATIONS)
+    conn.close()
+
+    loaded = PlaneMap(db_file=db_file, being_culture=BeingCulture.WEIRD)
+    np.testing.assert_array_equal(loaded.nodes.cluster_id, plane_map.nodes.cluster_id)
+
+    resources = get_cluster_resources(db_file, BeingCulture.WEIRD.value)
+    pop_center_ids = plane_map.nodes.node_id[plane_map.nodes.is_population_center]
+    np.testing.assert_array_equal(resources["cluster_id"], np.sort(pop_center_ids))
+    assert resources["num_nodes"].sum() == len(plane_map.nodes)
+
+    new_nodes, _ = loaded.add_stratum(k=5, db_file=db_file)
+    assert set(new_nodes.stratum_id.tolist()) == {4}
+
+
+def test_configure_bulk_write_rejects_unknown_pragma_values(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / "pragmas.db"))
+    configure_bulk_write(conn, journal_mode="wal", synchronous="off")
+
+    with pytest.raises(ValueError, match="journal_mode"):
+        configure_bulk_write(conn, journal_mode="WAL; DROP TABLE nodes")
+    with pytest.raises(ValueError, match="synchronous"):
+        configure_bulk_write(conn, synchronous="4")
+    conn.close()
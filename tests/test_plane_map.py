@@ -0,0 +1,59 @@
+import pytest
+
+from rattle_snake.constants import BeingCulture
+from rattle_snake.placement import InfeasiblePlacementError
+from rattle_snake.plane_map import PlaneMap
+from rattle_snake.tables import NodeTable
+
+
+def small_plane_map() -> PlaneMap:
+    return PlaneMap(
+        being_culture=BeingCulture.WEIRD,
+        num_circles=3,
+        center_k=3,
+        k=5,
+        min_support=3,
+        max_support=5,
+        seed=0,
+    )
+
+
+def test_add_stratum():
+    plane_map = small_plane_map()
+    num_nodes = len(plane_map.nodes)
+
+    new_nodes, _ = plane_map.add_stratum(k=5, min_support=3, max_support=5)
+
+    assert plane_map.num_circles == 4
+    assert len(plane_map.stratum_boundaries) == 4
+    assert set(new_nodes.stratum_id.tolist()) == {4}
+    assert len(plane_map.nodes) == num_nodes + len(new_nodes)
+
+
+def test_add_stratum_keeps_strata_when_placement_fails():
+    plane_map = small_plane_map()
+    nodes = plane_map.nodes
+    edges = plane_map.edges
+    stratum_boundaries = list(plane_map.stratum_boundaries)
+
+    with pytest.raises(InfeasiblePlacementError):
+        plane_map.add_stratum(k=1000)
+
+    assert plane_map.num_circles == 3
+    assert list(plane_map.stratum_boundaries) == stratum_boundaries
+    assert plane_map.nodes is nodes
+    assert plane_map.edges is edges
+    assert plane_map.num_circles == int(plane_map.nodes.stratum_id.max())
+
+
+def test_add_stratum_needs_a_population_center_per_cluster():
+    plane_map = small_plane_map()
+    # clusters keyed by node_id like databases written before cluster ids
+    data = plane_map.nodes.data.copy()
+    data["cluster_id"] = data["node_id"]
+    plane_map.nodes = NodeTable(data, plane_map.nodes.plane)
+
+    with pytest.raises(ValueError, match="without a population center"):
+        plane_map.add_stratum(k=5)
+
+    assert plane_map.num_circles == 3
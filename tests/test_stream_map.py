@@ -0,0 +1,37 @@
+import sqlite3
+
+import pytest
+
+from rattle_snake.constants import BeingCulture
+from rattle_snake.db_helpers import db_setup, get_cluster_resources
+from rattle_snake.placement import InfeasiblePlacementError
+from rattle_snake.stream_map import stream_plane_to_db
+
+
+def count_plane_rows(db_file: str, plane: str):
+    conn = sqlite3.connect(db_file)
+    counts = [
+        conn.execute(
+            f"SELECT COUNT(*) from {table} where plane = ?", (plane,)
+        ).fetchone()[0]
+        for table in ("nodes", "edges")
+    ]
+    conn.close()
+    return counts
+
+
+def test_stream_plane_to_db_deletes_the_plane_when_it_fails(tmp_path):
+    db_file = str(tmp_path / "stream.db")
+    db_setup(db_file)
+    stream_plane_to_db(db_file, being_culture=BeingCulture.DREAM, seed=0)
+    dream_rows = count_plane_rows(db_file, BeingCulture.DREAM.value)
+
+    # stratum 3 has no room for 11 population centers
+    with pytest.raises(InfeasiblePlacementError):
+        stream_plane_to_db(
+            db_file, being_culture=BeingCulture.WEIRD, num_circles=8, k=11, seed=0
+        )
+
+    assert count_plane_rows(db_file, BeingCulture.WEIRD.value) == [0, 0]
+    assert count_plane_rows(db_file, BeingCulture.DREAM.value) == dream_rows
+    assert len(get_cluster_resources(db_file, BeingCulture.WEIRD.value)) == 0